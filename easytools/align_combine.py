@@ -1,6 +1,9 @@
 """
 2D image  aligment procedure using FFT
 from https://github.com/bandang0/astro_reduce/blob/master/cosmetic.py
+
+FFT cross-correlation aligner : reference FFT computed once, sub-pixel peak fit, bilinear or fourier shifts
+drizzle overlap matrices : shift-and-add of sub-pixel shifted frames on a finer grid
 """
 
 from os.path import basename
@@ -9,14 +12,103 @@ import click
 import numpy as np
 from astropy.io import fits
 from scipy.signal import fftconvolve
+from scipy import ndimage, sparse
 from logger_utils import logger
 
-def align_and_combine(infiles: list[str], operation) -> np:
+def _peak_offset(before: float, peak: float, after: float) -> float:
+    '''Sub-pixel offset of a cross-correlation peak : vertex of the parabola through the peak and its 2 neighbours.
+    '''
+    curvature = before - 2 * peak + after
+    if curvature >= 0:
+        return 0.
+    return float(0.5 * (before - after) / curvature)
+
+def phase_correlation_shifts(reference: np, images: list[np]) -> list[tuple[float, float]]:
+    '''Return the (y, x) sub-pixel shifts to apply to each image to realign it on reference.
+    The reference transform is computed once, each image costs one rfft2 and one irfft2.
+    '''
+    ref_fft = np.fft.rfft2(reference.astype(np.float32))
+    return [phase_correlation_shift(ref_fft, image) for image in images]
+
+def phase_correlation_shift(ref_fft: np, image: np) -> tuple[float, float]:
+    '''Return the (y, x) sub-pixel shift to apply to image to realign it on the reference whose rfft2 is ref_fft.
+    The peak of the plain (not normalised) cross-correlation is fitted : a fully normalised cross-power spectrum 
+    gives as much weight to noisy high frequencies as to the signal, which flattens the peak and biases the fit
+    toward whole pixels.
+    '''
+    shape = image.shape
+    cross_power = ref_fft * np.conj(np.fft.rfft2(image.astype(np.float32)))
+    ### mean levels (pedestal, sky) removed
+    cross_power[0, 0] = 0
+    correlation = np.fft.irfft2(cross_power, s = shape)
+
+    peak = np.unravel_index(np.argmax(correlation), shape)
+    shift = []
+    for axis in (0, 1):
+        ### neighbours of the peak along axis, with wrap-around
+        before, after = list(peak), list(peak)
+        before[axis] = (peak[axis] - 1) % shape[axis]
+        after[axis] = (peak[axis] + 1) % shape[axis]
+        offset = peak[axis] + _peak_offset(correlation[tuple(before)], correlation[peak], correlation[tuple(after)])
+        ### peaks beyond half the field are negative shifts
+        shift.append(offset - shape[axis] if offset > shape[axis] / 2 else offset)
+    return (float(shift[0]), float(shift[1]))
+
+def drizzle_matrix(size: int, shift: float, scale: int = 2, pixfrac: float = 1.0) -> sparse.csr_matrix:
+    '''Return the (size * scale, size) sparse matrix of overlaps, along one axis, between input pixels shifted by shift 
+    and shrunk by pixfrac (drops) and the output grid, scale times finer.
+    A translation is separable : the 2D overlap of pixel (i, k) with output pixel (j, l) is rows[j, i] * cols[l, k].
+    '''
+    n_out = size * scale
+    ### drop edges in output pixel units (input pixel i covers [i, i + 1])
+    low = scale * (np.arange(size) + 0.5 + shift - pixfrac / 2)
+    high = low + scale * pixfrac
+    first = np.floor(low).astype(int)
+    span = int(np.ceil(scale * pixfrac)) + 1
+
+    rows, cols, overlaps = [], [], []
+    for k in range(span):
+        out_index = first + k
+        overlap = np.minimum(high, out_index + 1) - np.maximum(low, out_index)
+        valid = (overlap > 0) & (out_index >= 0) & (out_index < n_out)
+        rows.append(out_index[valid])
+        cols.append(np.nonzero(valid)[0])
+        overlaps.append(overlap[valid])
+
+    return sparse.csr_matrix((np.concatenate(overlaps).astype(np.float32), (np.concatenate(rows), np.concatenate(cols))),
+                             shape = (n_out, size))
+
+def shift_image(image: np, shift: tuple[float, float], method: str = 'bilinear') -> np:
+    '''Shift an image by a (y, x) sub-pixel amount.
+    bilinear : linear interpolation, uncovered borders are set to 0 instead of wrapped around
+    fourier : phase ramp applied to the image rfft2 (flux preserving, no smoothing) - edges wrap around as with np.roll
+    '''
+    image = image.astype(np.float32)
+    if method == 'fourier':
+        shifted = ndimage.fourier_shift(np.fft.rfft2(image), shift, n = image.shape[1])
+        return np.fft.irfft2(shifted, s = image.shape).astype(np.float32)
+    elif method == 'bilinear':
+        return ndimage.shift(image, shift, order = 1, mode = 'constant', cval = 0.)
+    else:
+        raise ValueError(f'unknown shift method : {method}')
+
+def align_and_combine(infiles: list[str], operation, method: str = 'fftconvolve', shift_method: str = 'bilinear') -> np:
     '''Read fits data from list of files, return aligned and operation(sum, median, etc...) version.
+    method 'phase' uses phase correlation with sub-pixel shifts instead of fftconvolve and whole pixels rolls.
     '''
     if len(infiles) == 1:
         return fits.getdata(infiles[0])
 
+    if method == 'phase':
+        logger.info('phase correlation running...')
+        images = [fits.getdata(_).astype(np.float32) for _ in infiles]
+        shifts = phase_correlation_shifts(images[0], images[1:])
+        logger.info('images shifts = ' + repr([(round(dy, 2), round(dx, 2)) for dy, dx in shifts]))
+        realigned_images = [shift_image(image, shifts[i], shift_method) for (i, image) in enumerate(images[1:])]
+        realigned_images.append(images[0])
+        logger.info('{} Combine operation running...'.format(repr(operation)))
+        return operation(realigned_images, axis=0)
+
     # Collect arrays and crosscorrelate all (except the first) with the first.
     logger.info('fftconvolve running...')
     images = [fits.getdata(_).astype(np.float32) for _ in infiles]
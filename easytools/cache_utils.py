@@ -0,0 +1,158 @@
+#
+# content-addressed cache of master frames (bias, dark, flat...), of per frame masks
+# and of per frame checkpoints of reduction chains
+#
+import os, json, hashlib
+import numpy as np
+from logger_utils import logger
+from astropy.io import fits
+from astropy import units as u
+from astropy.nddata import CCDData, VarianceUncertainty
+
+### FIT header keyword holding the inputs key of a cached master frame
+cache_keyword = 'CACHEKEY'
+
+class cache_utils:
+
+    @staticmethod
+    def inputs_key(file_paths: list, **params) -> str:
+        """
+        returns a hash of the input files (name, size, last modified time) and of the build parameters
+        """
+        inputs = [(os.path.abspath(fp), os.stat(fp).st_size, os.stat(fp).st_mtime_ns) for fp in file_paths]
+        description = json.dumps({'inputs': inputs, 'params': params}, sort_keys = True, default = str)
+        return hashlib.sha256(description.encode()).hexdigest()
+
+    @staticmethod
+    def load_master(path: str, key: str) -> CCDData | None:
+        """
+        returns the master frame stored in path if it was built from inputs matching key, else None
+        """
+        if not os.path.isfile(path):
+            return None
+        try:
+            master = CCDData.read(path, unit = u.Unit('adu'))
+        except Exception as err:
+            logger.warning(f'cache : cannot read {path} ({err})')
+            return None
+        if master.header.get(cache_keyword) != key:
+            logger.info(f'cache : {path} is out of date')
+            return None
+        return master
+
+    @staticmethod
+    def save_master(master: CCDData, path: str, key: str) -> None:
+        """
+        stores a master frame with the key of its inputs
+        """
+        master.header[cache_keyword] = key
+        master.write(path, overwrite = True)
+        logger.info(f'cache : {path} saved')
+
+    @staticmethod
+    def data_key(data: np.ndarray, **params) -> str:
+        """
+        returns a hash of an image array contents and of the parameters applied to it
+        """
+        digest = hashlib.sha256(np.ascontiguousarray(data).tobytes())
+        digest.update(json.dumps(params, sort_keys = True, default = str).encode())
+        return digest.hexdigest()
+
+    @staticmethod
+    def load_mask(path: str, key: str) -> np.ndarray | None:
+        """
+        returns the boolean mask stored in path if it was computed from data matching key, else None
+        """
+        if not os.path.isfile(path):
+            return None
+        try:
+            with fits.open(path) as hdul:
+                if hdul[0].header.get(cache_keyword) != key:
+                    return None
+                return hdul[0].data.astype(bool)
+        except Exception as err:
+            logger.warning(f'cache : cannot read {path} ({err})')
+            return None
+
+    @staticmethod
+    def save_mask(mask: np.ndarray, path: str, key: str) -> None:
+        """
+        stores a boolean mask (as uint8) with the key of the data it was computed from
+        """
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        hdu = fits.PrimaryHDU(mask.astype(np.uint8))
+        hdu.header[cache_keyword] = key
+        hdu.writeto(path, overwrite = True)
+
+    @staticmethod
+    def chain_key(key: str, *inputs) -> str:
+        """
+        returns the key of a result computed from the result of key by a stage described by inputs
+        (strings, numbers or CCDData frames - frames are hashed with their header)
+        """
+        digest = hashlib.sha256(key.encode())
+        for value in inputs:
+            if isinstance(value, CCDData):
+                value = cache_utils.data_key(value.data, header = dict(value.header))
+            digest.update(json.dumps(value, sort_keys = True, default = str).encode())
+        return digest.hexdigest()
+
+    @staticmethod
+    def load_checkpoint(directory: str, key: str) -> CCDData | None:
+        """
+        returns the frame checkpointed as key in directory, None if not found
+        data, mask and variance are memory-mapped copy-on-write : pages are read on access, never written back
+        """
+        data_path = os.path.join(directory, f'{key}.npy')
+        if not os.path.isfile(data_path):
+            return None
+        try:
+            header = fits.Header.fromfile(os.path.join(directory, f'{key}.hdr'), sep = '\n', endcard = False, padding = False)
+            mask_path, variance_path = os.path.join(directory, f'{key}.mask.npy'), os.path.join(directory, f'{key}.var.npy')
+            return CCDData(np.load(data_path, mmap_mode = 'c'), unit = u.Unit(header.get('BUNIT', 'adu')), header = header,
+                           mask = np.load(mask_path, mmap_mode = 'c') if os.path.isfile(mask_path) else None,
+                           uncertainty = VarianceUncertainty(np.load(variance_path, mmap_mode = 'c')) if os.path.isfile(variance_path) else None)
+        except Exception as err:
+            logger.warning(f'checkpoint : cannot read {data_path} ({err})')
+            return None
+
+    @staticmethod
+    def save_checkpoint(image: CCDData, directory: str, key: str) -> None:
+        """
+        stores a frame as float32 .npy files (data, mask, variance) and its header as text
+        data is written last thru a rename : a frame is checkpointed only once all its files are complete
+        """
+        os.makedirs(directory, exist_ok = True)
+        header = image.header.copy()
+        header['BUNIT'] = image.unit.to_string()
+        with open(os.path.join(directory, f'{key}.hdr'), 'w') as header_file:
+            header_file.write(header.tostring(sep = '\n', endcard = False, padding = False))
+        if image.mask is not None:
+            np.save(os.path.join(directory, f'{key}.mask.npy'), np.asarray(image.mask, dtype = bool))
+        if image.uncertainty is not None:
+            np.save(os.path.join(directory, f'{key}.var.npy'), 
+                    np.asarray(image.uncertainty.represent_as(VarianceUncertainty).array, dtype = np.float32))
+        temp_path = os.path.join(directory, f'{key}.tmp.npy')
+        np.save(temp_path, np.asarray(image.data, dtype = np.float32))
+        os.replace(temp_path, os.path.join(directory, f'{key}.npy'))
+
+    @staticmethod
+    def load_attributes(directory: str, key: str) -> dict | None:
+        """
+        returns the attributes (JSON) of a set checkpointed as key, None if not found
+        """
+        path = os.path.join(directory, f'{key}.json')
+        if not os.path.isfile(path):
+            return None
+        with open(path) as attributes_file:
+            return json.load(attributes_file)
+
+    @staticmethod
+    def save_attributes(attributes: dict, directory: str, key: str) -> None:
+        """
+        stores the attributes (JSON) of a set checkpointed as key - written last, once all frames are checkpointed
+        """
+        temp_path = os.path.join(directory, f'{key}.tmp.json')
+        with open(temp_path, 'w') as attributes_file:
+            json.dump(attributes, attributes_file, default = str)
+        os.replace(temp_path, os.path.join(directory, f'{key}.json'))
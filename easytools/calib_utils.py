@@ -0,0 +1,112 @@
+#
+# vectorised calibration kernels working on a block of frames (3-D float32 array or memmap)
+# an optional variance block (same shape, float32) is propagated in place
+#
+import numpy as np
+from astropy.nddata import CCDData, VarianceUncertainty
+
+class calib_utils:
+
+    @staticmethod
+    def create_variance(data: np.ndarray, gain: float, readnoise: float) -> np.ndarray:
+        """
+        returns the float32 variance plane (adu²) of a raw frame : photon noise + read noise
+            variance = data / gain + (readnoise / gain)²       (gain in e-/adu, readnoise in e-)
+        """
+        variance = np.maximum(np.asarray(data, dtype = np.float32), 0)
+        variance /= np.float32(gain)
+        variance += np.float32((readnoise / gain) ** 2)
+        return variance
+
+    @staticmethod
+    def get_variance(image: CCDData) -> np.ndarray | None:
+        """
+        returns the float32 variance plane of an image uncertainty (any astropy representation), None if no uncertainty
+        """
+        if image.uncertainty is None:
+            return None
+        if isinstance(image.uncertainty, VarianceUncertainty):
+            return np.asarray(image.uncertainty.array, dtype = np.float32)
+        return np.asarray(image.uncertainty.represent_as(VarianceUncertainty).array, dtype = np.float32)
+
+    @staticmethod
+    def uncertainty_as(master: CCDData | None, kind: type) -> CCDData | None:
+        """
+        returns master with its uncertainty represented as kind (eg. VarianceUncertainty), sharing its data
+        ccdproc refuses frames and masters with different uncertainty classes - master is returned as is if no conversion is needed
+        """
+        if master is None or master.uncertainty is None or kind is type(None) or isinstance(master.uncertainty, kind):
+            return master
+        return CCDData(master.data, unit = master.unit, header = master.header, mask = master.mask, wcs = master.wcs,
+                       uncertainty = master.uncertainty.represent_as(kind))
+
+    @staticmethod
+    def prepare_masters(master_bias: CCDData | None = None, master_dark: CCDData | None = None,
+                        master_flat: CCDData | None = None, exposure_key: str = 'EXPTIME') -> dict:
+        """
+        returns master frames as float32 arrays, computed once for a whole batch :
+            - bias, dark and dark exposure time (read from exposure_key)
+            - flat normalised by its mean (as ccdproc flat_correct does)
+            - variance planes of masters that carry an uncertainty (flat variance is normalised too)
+        """
+        masters = {'bias': None, 'dark': None, 'dark_exposure': None, 'flat': None,
+                   'bias_variance': None, 'dark_variance': None, 'flat_variance': None}
+        if master_bias is not None:
+            masters['bias'] = np.asarray(master_bias.data, dtype = np.float32)
+            masters['bias_variance'] = calib_utils.get_variance(master_bias)
+        if master_dark is not None:
+            masters['dark'] = np.asarray(master_dark.data, dtype = np.float32)
+            masters['dark_exposure'] = float(master_dark.header[exposure_key])
+            masters['dark_variance'] = calib_utils.get_variance(master_dark)
+        if master_flat is not None:
+            flat = np.asarray(master_flat.data, dtype = np.float32)
+            flat_mean = np.float32(flat.mean())
+            masters['flat'] = flat / flat_mean
+            flat_variance = calib_utils.get_variance(master_flat)
+            if flat_variance is not None:
+                masters['flat_variance'] = flat_variance / flat_mean ** 2
+        return masters
+
+    @staticmethod
+    def read_exposures(headers: list, exposure_key: str = 'EXPTIME') -> np.ndarray:
+        """
+        returns exposure times of all frames of a batch in a single pass
+        """
+        return np.array([header[exposure_key] for header in headers], dtype = np.float64)
+
+    @staticmethod
+    def calibrate_block(block: np.ndarray, exposures: np.ndarray, masters: dict, variance: np.ndarray | None = None) -> np.ndarray:
+        """
+        calibrates in place a block of frames (n_frames, n_rows, n_cols) :
+            block = (block - bias - dark * exposure / dark_exposure) / normalised flat
+        and propagates in place the variance block, if any :
+            variance = (variance + var_bias + var_dark * scale²) / flat² + block² * var_flat / flat²
+        only one frame sized buffer is allocated
+        """
+        buffer = np.empty(block.shape[1:], dtype = np.float32)
+        if masters['bias'] is not None:
+            block -= masters['bias']
+            if variance is not None and masters['bias_variance'] is not None:
+                variance += masters['bias_variance']
+
+        if masters['dark'] is not None:
+            for i, scale in enumerate(exposures / masters['dark_exposure']):
+                np.multiply(masters['dark'], np.float32(scale), out = buffer)
+                block[i] -= buffer
+                if variance is not None and masters['dark_variance'] is not None:
+                    np.multiply(masters['dark_variance'], np.float32(scale ** 2), out = buffer)
+                    variance[i] += buffer
+
+        if masters['flat'] is not None:
+            block /= masters['flat']
+            if variance is not None:
+                flat_squared = np.square(masters['flat'])
+                variance /= flat_squared
+                if masters['flat_variance'] is not None:
+                    relative_variance = masters['flat_variance'] / flat_squared
+                    for i in range(len(block)):
+                        np.multiply(block[i], block[i], out = buffer)
+                        buffer *= relative_variance
+                        variance[i] += buffer
+
+        return block
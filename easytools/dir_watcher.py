@@ -0,0 +1,184 @@
+#
+# watches a capture directory and pushes incremental changes (added, removed, modified files) to a callback
+# uses native file system events (inotify, FSEvents, ReadDirectoryChangesW) when watchdog is installed,
+# else polls the directory last modified time (one stat per interval) with a periodic full rescan
+# events are delivered on the asyncio loop of the caller (the jupyter kernel loop), in batches
+#
+import os, time, queue, fnmatch, asyncio, threading
+from typing import Callable
+from logger_utils import logger
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+class _EventHandler(FileSystemEventHandler):
+    """
+    forwards the names touched by native events to the watcher queue
+    """
+    def __init__(self, changes: queue.Queue):
+        self._changes = changes
+
+    def on_any_event(self, event) -> None:
+        for path in (event.src_path, getattr(event, 'dest_path', '')):
+            if path:
+                self._changes.put(os.path.basename(os.fsdecode(path)))
+
+class DirWatcher(object):
+    """
+    keeps the listing (name -> last modified time) of one directory up to date
+    callback(events) receives lists of (kind, name) with kind 'added', 'removed' or 'modified'
+    """
+    def __init__(self, callback: Callable[[list], None], interval: float = 1.0, rescan: float = 10.0,
+                 latency: float = 0.2, native: bool = True):
+        self._callback = callback
+        self.interval = interval
+        self.rescan = rescan
+        self.latency = latency
+        self.native = native and Observer is not None
+        try:
+            self._loop = asyncio.get_running_loop()
+        except RuntimeError:
+            ### no event loop (script) : callback runs in the watch thread
+            self._loop = None
+        self.path = None
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._changes = queue.Queue()
+        self._stop = threading.Event()
+        self._thread = None
+        self._observer = None
+
+    """
+    watch path (stop watching the previous one) - the initial listing is pushed as 'added' events
+    """
+    def watch(self, path: str) -> None:
+        self.stop()
+        self.path = path
+        with self._lock:
+            self._entries = {}
+        self._changes = queue.Queue()
+        self._stop = threading.Event()
+        if self.native:
+            try:
+                self._observer = Observer()
+                self._observer.schedule(_EventHandler(self._changes), path, recursive = False)
+                self._observer.start()
+            except Exception as error:
+                logger.warning(f'watcher : native events not available on {path} ({error}) - polling')
+                self._observer = None
+        self._thread = threading.Thread(target = self._run, args = (path, self._changes, self._stop),
+                                        name = 'EASYASTRO_watch_thread', daemon = True)
+        self._thread.start()
+        logger.debug(f'watcher : {path} watched ({"events" if self._observer else "polling"})')
+
+    """
+    stop watching
+    """
+    def stop(self) -> None:
+        self._stop.set()
+        ### wakes up the watch thread waiting for events
+        self._changes.put(None)
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer = None
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+
+    """
+    returns the names of watched files matching pattern, reverse sorted by last modified time (as files_utils.list_files)
+    """
+    def files(self, pattern: str = '*') -> list:
+        with self._lock:
+            names = sorted(self._entries, key = self._entries.get, reverse = True)
+        return fnmatch.filter(names, pattern)
+
+    def _run(self, path: str, changes: queue.Queue, stop: threading.Event) -> None:
+        self._update(path, None)
+        last_scan = time.monotonic()
+        try:
+            last_mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            last_mtime = None
+
+        while not stop.is_set():
+            if self._observer is not None:
+                ### native events : sleeps until a change, then gathers the burst of events that follows it
+                try:
+                    names = {changes.get(timeout = self.rescan)}
+                except queue.Empty:
+                    continue
+                stop.wait(self.latency)
+                while not changes.empty():
+                    names.add(changes.get_nowait())
+                names.discard(None)
+                if not stop.is_set() and len(names) > 0:
+                    self._update(path, names)
+                continue
+
+            ### polling : files added, removed or renamed change the directory last modified time
+            stop.wait(self.interval)
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                continue
+            if mtime != last_mtime or time.monotonic() - last_scan >= self.rescan:
+                ### a full rescan also catches files rewritten in place
+                last_mtime, last_scan = mtime, time.monotonic()
+                self._update(path, None)
+
+    def _update(self, path: str, names: set | None) -> None:
+        """
+        stat the changed names (all files if names is None) and push the differences with the current listing
+        """
+        if names is None:
+            current = {}
+            try:
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        try:
+                            current[entry.name] = entry.stat().st_mtime_ns
+                        except OSError:
+                            pass
+            except OSError as error:
+                logger.error(f'watcher : cannot list {path} ({error})')
+                return
+        else:
+            current = {}
+            for name in names:
+                try:
+                    current[name] = os.stat(os.path.join(path, name)).st_mtime_ns
+                except OSError:
+                    current[name] = None
+
+        events = []
+        with self._lock:
+            previous = self._entries if names is None else {name: self._entries.get(name) for name in names}
+            for name, mtime in current.items():
+                if mtime is None:
+                    if previous.get(name) is not None:
+                        events.append(('removed', name))
+                        del self._entries[name]
+                elif previous.get(name) is None:
+                    events.append(('added', name))
+                    self._entries[name] = mtime
+                elif previous[name] != mtime:
+                    events.append(('modified', name))
+                    self._entries[name] = mtime
+            if names is None:
+                for name in set(previous) - set(current):
+                    events.append(('removed', name))
+                    del self._entries[name]
+
+        if len(events) > 0:
+            self._push(events)
+
+    def _push(self, events: list) -> None:
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._callback, events)
+        else:
+            self._callback(events)
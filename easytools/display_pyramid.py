@@ -0,0 +1,65 @@
+#
+# multi-resolution display of large frames : power of two block_reduce levels built once per image
+# the viewer only draws the window of the level matching the canvas size and zoom (full resolution once zoomed in)
+#
+import math
+import numpy as np
+from astropy.nddata.blocks import block_reduce
+
+class DisplayPyramid(object):
+    """
+    levels[0] is the image itself, levels[k] the mean of 2^k x 2^k pixels blocks (float32), down to min_size pixels
+    windows are aligned on tile_size pixels tiles of their level, with one tile margin, so small pans reuse them
+    """
+    def __init__(self, data: np.ndarray, min_size: int = 512, tile_size: int = 256):
+        self.data = data
+        self.tile_size = tile_size
+        self.levels = [data]
+        ### colour images (rows, cols, channels) : channels are never reduced
+        block = (2, 2) + (1,) * (data.ndim - 2)
+        while max(self.levels[-1].shape[:2]) > min_size and min(self.levels[-1].shape[:2]) >= 2:
+            self.levels.append(block_reduce(self.levels[-1], block, func = np.mean).astype(np.float32, copy = False))
+        self._window = None
+
+    """
+    returns the pyramid level showing the visible region (data pixels) on a canvas (screen pixels) at least at screen resolution
+    """
+    def level_for(self, visible_width: float, visible_height: float, canvas_width: float, canvas_height: float) -> int:
+        ratio = min(visible_width / max(canvas_width, 1), visible_height / max(canvas_height, 1))
+        if ratio < 2:
+            return 0
+        return min(int(math.log2(ratio)), len(self.levels) - 1)
+
+    """
+    returns (window, extent) to draw for the visible region x0..x1, y0..y1 (data coordinates) on a canvas of canvas_width x canvas_height pixels
+    returns (None, None) if the current window already covers the region at the right level
+    """
+    def view(self, x0: float, x1: float, y0: float, y1: float, canvas_width: float, canvas_height: float) -> tuple:
+        x0, x1, y0, y1 = min(x0, x1), max(x0, x1), min(y0, y1), max(y0, y1)
+        level = self.level_for(x1 - x0, y1 - y0, canvas_width, canvas_height)
+        scale = 1 << level
+        n_rows, n_cols = self.levels[level].shape[:2]
+        ### visible region in level pixels
+        vc0, vc1 = max(int(x0 / scale), 0), min(int(math.ceil(x1 / scale)), n_cols)
+        vr0, vr1 = max(int(y0 / scale), 0), min(int(math.ceil(y1 / scale)), n_rows)
+        if vc1 <= vc0 or vr1 <= vr0:
+            return None, None
+        if self._window is not None:
+            window_level, wr0, wr1, wc0, wc1 = self._window
+            ### reused while it covers the region and is not much larger (zoom in)
+            if window_level == level and wr0 <= vr0 and vr1 <= wr1 and wc0 <= vc0 and vc1 <= wc1 and \
+               wr1 - wr0 <= vr1 - vr0 + 4 * self.tile_size and wc1 - wc0 <= vc1 - vc0 + 4 * self.tile_size:
+                return None, None
+
+        ### extended to whole tiles plus one tile margin
+        tile = self.tile_size
+        c0, c1 = max((vc0 // tile - 1) * tile, 0), min((-(-vc1 // tile) + 1) * tile, n_cols)
+        r0, r1 = max((vr0 // tile - 1) * tile, 0), min((-(-vr1 // tile) + 1) * tile, n_rows)
+        self._window = (level, r0, r1, c0, c1)
+        return self.levels[level][r0:r1, c0:c1], [c0 * scale, c1 * scale, r0 * scale, r1 * scale]
+
+    """
+    forget the current window (next view call always returns a window)
+    """
+    def reset(self) -> None:
+        self._window = None
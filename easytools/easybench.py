@@ -0,0 +1,199 @@
+""" EasyBench : reproducible benchmarks of the EasyCombiner / Images reduction pipeline
+
+synthetic frames (star field + spectrum trace, sub-pixel jitter) are generated in a temporary directory,
+then every stage runs in its own process to measure : wall time, peak RSS and bytes read from files.
+results are written as JSON to compare commits.
+
+usage :
+        python easybench.py --frames 20 --shape 1000 1500 --output bench.json
+        python easybench.py --stages median sigmaclip --repeat 3
+"""
+import os, sys, time, json, argparse, platform, subprocess, tempfile, resource
+import multiprocessing as mp
+import numpy as np
+from astropy.io import fits
+from astropy import units as u
+from astropy.nddata import CCDData
+
+stages = ['from_fit', 'trim', 'reduce', 'reduce_batch', 'spec_align', 'star_align', 'median', 'sigmaclip']
+
+def _synthetic_frame(rng, stars: np.ndarray, shape: tuple, dy: float, dx: float, lines: tuple = ()) -> np.ndarray:
+    """
+    float frame : noise (sigma 10 on a 1000 adu pedestal) + gaussian stars + an horizontal spectrum trace 
+    (with absorption lines at columns lines), shifted by (dy, dx)
+    """
+    n_rows, n_cols = shape
+    rows, cols = np.ogrid[:n_rows, :n_cols]
+    image = rng.normal(1000, 10, shape)
+    continuum = 1.5 + np.sin((cols - dx) / 9.)
+    for line in lines:
+        continuum = continuum * (1 - 0.6 * np.exp(-((cols - line - dx) ** 2) / 8.))
+    image += 5000 * np.exp(-((rows - n_rows / 2 - dy) ** 2) / 8.) * continuum
+    for y, x, flux in stars:
+        y1, y2, x1, x2 = int(max(0, y - 8)), int(min(n_rows, y + 8)), int(max(0, x - 8)), int(min(n_cols, x + 8))
+        image[y1:y2, x1:x2] += flux * np.exp(-((rows[y1:y2] - y - dy) ** 2 + (cols[:, x1:x2] - x - dx) ** 2) / 4.5)
+    return image
+
+def _random_stars(rng, shape: tuple) -> np.ndarray:
+    n_rows, n_cols = shape
+    return np.column_stack([rng.uniform(10, n_rows - 10, 60), rng.uniform(10, n_cols - 10, 60), rng.uniform(2000, 20000, 60)])
+
+def generate_frames(directory: str, frames: int, shape: tuple, seed: int = 0) -> None:
+    """
+    writes frames uint16 FIT images : gaussian stars + an horizontal spectrum trace, shifted by random sub-pixel offsets
+    """
+    rng = np.random.default_rng(seed)
+    stars = _random_stars(rng, shape)
+    for i in range(frames):
+        dy, dx = rng.uniform(-3, 3, 2)
+        image = _synthetic_frame(rng, stars, shape, dy, dx)
+        hdu = fits.PrimaryHDU(np.clip(image, 0, 65535).astype(np.uint16))
+        hdu.header['EXPTIME'] = 60.
+        hdu.header['DATE-OBS'] = f'2024-01-01T00:{i // 60:02d}:{i % 60:02d}'
+        hdu.writeto(os.path.join(directory, f'bench-{i:04d}.fit'), overwrite = True)
+
+def check_shifts(shape: tuple = (400, 600), trials: int = 10, seed: int = 0) -> dict:
+    """
+    accuracy of the sub-pixel shifts measured by align_combine.phase_correlation_shift on noisy frames
+    with known fractional offsets (star field + spectrum trace, and spectrum trace with absorption lines alone) - errors in pixels
+    """
+    from align_combine import phase_correlation_shift
+    rng = np.random.default_rng(seed)
+    report = {}
+    lines = tuple(rng.uniform(20, shape[1] - 20, 8))
+    for field, stars in (('stars', _random_stars(rng, shape)), ('spectrum', np.empty((0, 3)))):
+        ref_fft = np.fft.rfft2(_synthetic_frame(rng, stars, shape, 0., 0., lines).astype(np.float32))
+        errors = []
+        for _ in range(trials):
+            dy, dx = rng.uniform(-3, 3, 2)
+            shift = phase_correlation_shift(ref_fft, _synthetic_frame(rng, stars, shape, dy, dx, lines))
+            ### the shift realigns the frame : it is the opposite of its offset
+            errors.append(max(abs(shift[0] + dy), abs(shift[1] + dx)))
+        report[field] = {'max_error_px': round(float(np.max(errors)), 4), 'mean_error_px': round(float(np.mean(errors)), 4)}
+    return report
+
+def _masters(shape: tuple) -> tuple:
+    bias = CCDData(np.full(shape, 1000., dtype = np.float32), unit = u.adu)
+    dark = CCDData(np.full(shape, 5., dtype = np.float32), unit = u.adu, meta = {'EXPTIME': 120.})
+    flat = CCDData(np.full(shape, 10000., dtype = np.float32), unit = u.adu)
+    return bias, dark, flat
+
+def _read_bytes() -> int | None:
+    """
+    bytes read by this process thru read() calls (linux /proc only) - memory-mapped reads are not counted
+    """
+    try:
+        with open('/proc/self/io') as io:
+            return int(next(line for line in io if line.startswith('rchar')).split()[1])
+    except (OSError, StopIteration):
+        return None
+
+def _peak_rss() -> float:
+    """
+    peak resident memory of this process, in MB (ru_maxrss is in KB on linux, bytes on macOS)
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1e6 if sys.platform == 'darwin' else peak / 1e3
+
+def _run_stage(stage: str, directory: str, trim_region: str, queue) -> None:
+    """
+    runs one stage in a child process : setup is not timed, the stage itself is
+    """
+    from logger_utils import logger
+    from easycombiner import Images
+    logger.setLevel('WARNING')
+    operations = {
+        'from_fit': lambda images: Images.from_fit(directory, 'bench-*.fit'),
+        'trim': lambda images: images.trim(trim_region),
+        'reduce': lambda images: images.reduce(*_masters(images[0].shape)),
+        'reduce_batch': lambda images: images.reduce(*_masters(images[0].shape), batch = True),
+        'spec_align': lambda images: images.spec_align(method = 'phase'),
+        'star_align': lambda images: images.star_align(),
+        'median': lambda images: images.median(),
+        'sigmaclip': lambda images: images.sigmaclip(),
+    }
+    images = None if stage == 'from_fit' else Images.from_fit(directory, 'bench-*.fit')
+    if stage in ('spec_align', 'star_align'):
+        images = images.reduce(*_masters(images[0].shape), batch = True)
+
+    setup_rss, read_before = _peak_rss(), _read_bytes()
+    start_time = time.perf_counter()
+    operations[stage](images)
+    wall_time = time.perf_counter() - start_time
+    read_after = _read_bytes()
+    queue.put({
+        'stage': stage,
+        'wall_s': round(wall_time, 4),
+        'peak_rss_mb': round(_peak_rss(), 1),
+        'setup_rss_mb': round(setup_rss, 1),
+        'read_mb': None if read_before is None else round((read_after - read_before) / 1e6, 2),
+    })
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output = True, text = True, check = True,
+                              cwd = os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(frames: int = 20, shape: tuple = (1000, 1500), selected: list = stages, repeat: int = 1, seed: int = 0) -> dict:
+    """
+    generates the synthetic set, runs selected stages repeat times, returns the JSON report as a dict
+    """
+    n_rows, n_cols = shape
+    trim_region = f'{n_cols // 10}, {n_rows // 10}, {n_cols - n_cols // 10}, {n_rows - n_rows // 10}'
+    results = []
+    with tempfile.TemporaryDirectory(prefix = 'easybench-') as directory:
+        generate_frames(directory, frames, shape, seed)
+        input_size = sum(entry.stat().st_size for entry in os.scandir(directory))
+        for stage in selected:
+            for _ in range(repeat):
+                queue = mp.Queue()
+                process = mp.Process(target = _run_stage, args = (stage, directory, trim_region, queue))
+                process.start()
+                process.join()
+                if process.exitcode != 0:
+                    results.append({'stage': stage, 'error': f'exit code {process.exitcode}'})
+                else:
+                    results.append(queue.get())
+                print(json.dumps(results[-1]), file = sys.stderr)
+
+    return {
+        'meta': {
+            'commit': _git_commit(),
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'frames': frames,
+            'shape': list(shape),
+            'seed': seed,
+            'input_mb': round(input_size / 1e6, 2),
+        },
+        'results': results,
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'EasyCombiner pipeline benchmarks on synthetic frames')
+    parser.add_argument('--frames', type = int, default = 20, help = 'number of frames')
+    parser.add_argument('--shape', type = int, nargs = 2, default = (1000, 1500), metavar = ('ROWS', 'COLS'), help = 'frame size')
+    parser.add_argument('--stages', nargs = '+', choices = stages, default = stages, help = 'stages to run')
+    parser.add_argument('--repeat', type = int, default = 1, help = 'runs per stage')
+    parser.add_argument('--seed', type = int, default = 0, help = 'random seed of the synthetic set')
+    parser.add_argument('--output', default = None, help = 'JSON output file (default : stdout)')
+    parser.add_argument('--check-shifts', type = float, default = None, metavar = 'TOLERANCE',
+                        help = 'only check sub-pixel shifts accuracy on noisy frames, fails above TOLERANCE pixels')
+    args = parser.parse_args()
+
+    if args.check_shifts is not None:
+        accuracy = check_shifts(seed = args.seed)
+        print(json.dumps(accuracy, indent = 2))
+        sys.exit(1 if any(field['max_error_px'] > args.check_shifts for field in accuracy.values()) else 0)
+
+    report = json.dumps(run(args.frames, tuple(args.shape), args.stages, args.repeat, args.seed), indent = 2)
+    if args.output is None:
+        print(report)
+    else:
+        with open(args.output, 'w') as output:
+            output.write(report)
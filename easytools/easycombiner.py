@@ -14,15 +14,36 @@ master_sciences = Images.from_fit(dir = "../CAPTURE/test01/", filter = "agdra-*.
                         .trim('600, 600, 2700, 1400' ) \
                         .reduce(master_bias, master_dark, master_flat, 'EXPTIME') \
                         .spec_align()
+
+eg. : to build a master flat once, later calls load it unless its inputs changed :
+master_flat = Images.master_from_fit(dir = "../CAPTURE/test01/", filter = "flat-*.fit", 
+                                     output = "../CAPTURE/test01/masterflat.fit", 
+                                     trim_region = '600, 600, 2700, 1400')
+
+eg. : to combine a large set of frames without loading them into memory (streaming mode) :
+master_flat = Images.from_fit(dir = "../CAPTURE/test01/", filter = "flat-*.fit", streaming = True) \
+                    .median()
+
+eg. : to resume an interrupted reduction where it stopped (frames are checkpointed in a scratch directory) :
+master_sciences = Images.from_fit(dir = "../CAPTURE/test01/", filter = "agdra-*.fit", checkpoint = "../CAPTURE/test01/.scratch") \
+                        .trim('600, 600, 2700, 1400') \
+                        .reduce(master_bias, master_dark, master_flat, 'EXPTIME') \
+                        .spec_align()
+
+eg. : to stack the green channel of raw colour camera frames saved as 16 bits TIFF :
+master_green = Images.from_tiff(sorted(glob.glob("../CAPTURE/test01/m57-*.tif")), channel = 'G', bayer = 'RGGB') \
+                     .star_align() \
+                     .median()
                   
 """
-from typing import List, Tuple
-import warnings, fnmatch, os
+from typing import Callable, List, Tuple
+import warnings, fnmatch, os, time, inspect
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 import numpy as np
 from logger_utils import logger, handler
 from astropy.io import fits
 from astropy import units as u
-from astropy.nddata import CCDData, StdDevUncertainty
+from astropy.nddata import CCDData, StdDevUncertainty, VarianceUncertainty
 from astropy.visualization import astropy_mpl_style, quantity_support
 from astropy.utils.exceptions import AstropyWarning
 from ccdproc import combine, subtract_bias, subtract_dark, flat_correct
@@ -31,77 +52,433 @@ from ccdproc import ImageFileCollection, gain_correct
 from astropy.stats import mad_std
 import astroalign as aa
 from scipy.signal import fftconvolve
+from calib_utils import calib_utils
+from cache_utils import cache_utils
+from header_index import HeaderIndex
+from rgb_utils import rgb_utils, rgb_channels
+from align_combine import phase_correlation_shifts, phase_correlation_shift, shift_image, drizzle_matrix
 #warnings.simplefilter('ignore', category=AstropyWarning)
 #warnings.simplefilter('ignore', UserWarning)
 
+### star_align worker processes : reference control points are set once per process
+aa_max_control_points = 50
+_align_reference = {}
+
+def _init_align_worker(ref_control_points: np.ndarray, ref_shape: tuple) -> None:
+    _align_reference['control_points'] = ref_control_points
+    _align_reference['shape'] = ref_shape
+
+def _align_worker(index: int, data: np.ndarray | None) -> tuple:
+    """
+    align one frame (array or masked array) on the reference control points - returns (index, aligned data, footprint, error)
+    """
+    if data is None:
+        return index, None, None, None
+    try:
+        transform, _ = aa.find_transform(data, _align_reference['control_points'], max_control_points = aa_max_control_points)
+        reg_img, footprint = aa.apply_transform(transform, data, np.empty(_align_reference['shape'], dtype = np.float32),
+                                                propagate_mask = np.ma.isMaskedArray(data))
+        return index, reg_img, footprint, None
+    except Exception as err:
+        return index, None, None, repr(err)
+
+def _cosmic_worker(data: np.ndarray, lacosmic_args: dict) -> np.ndarray:
+    """
+    returns the cosmic rays mask of one frame (L.A.Cosmic)
+    """
+    _, mask = cosmicray_lacosmic(np.asarray(data, dtype = np.float32), **lacosmic_args)
+    return mask
+
 class EasyCombiner(object):
     """
     maintains images set array
     max memory is used by ccdproc routines to avoid OOM exceptions when working with large set of big images
+    in streaming mode (files is set), frames stay on disk and are combined by row strips sized from max memory
+    in deferred mode, per frame operations are recorded and run in a single pass by the terminal operation
+    (sum, median, sigmaclip, save, star_align, spec_align)
+    when a noise model (gain, readnoise) is set, frames read from files carry a float32 variance plane
+    propagated by reduce, spec_align and combines
+    when a checkpoint directory is set, every frame is saved after every recorded operation (and after
+    spec_align / star_align), keyed by the hash of its input file and of the operations applied : 
+    a restarted chain reloads the last saved result of each frame instead of computing it again
     """
-    def __init__(self, images: List[CCDData], max_memory: float = 4e9):
+    def __init__(self, images: List[CCDData], max_memory: float = 4e9, files: List[str] | None = None, deferred: bool = False):
         self._images = images
         self._memory_limit = max_memory
+        self._files = files
+        self._deferred = deferred
+        self._pending = []
+        self._sources = files
+        self._noise = None
+        self._checkpoint = None
+        self._keys = None
+        self.failed_frames = {}
     """
     returns a specific image array thru its index
     """
     def __getitem__(self, i:int) -> np.ndarray:
+        if self._files is not None:
+            return self._with_variance(CCDData.read(self._files[i], unit = u.Unit('adu')))
         return self._images[i]
 
     """
     returns the number of frames loaded in this set
     """
     def __len__(self) -> int:
+        if self._files is not None:
+            return len(self._files)
         return len(self._images)
 
     """
     returns the sum frame of frames loaded in this set
     """
     def sum(self) -> CCDData:
-        logger.info(f'sum combine on {len(self._images)} images ...')
-        return(combine(self._images,
-                       method = 'sum',
-                       dtype = np.float32,
-                       mem_limit = self._memory_limit)
-              )
+        logger.info(f'sum combine on {len(self)} images ...')
+        return self._combine(method = 'sum')
    
     """
     returns the sigmaclip'ed frame of frames loaded in this set
     """
     def sigmaclip(self, low_thresh: int = 5, high_thresh: int = 5) -> CCDData:
-        logger.info(f'sigmaclip combine on {len(self._images)} images ...')
-        return(combine(self._images,
-                       method = 'average',
-                       sigma_clip = True, 
-                       sigma_clip_low_thresh = low_thresh, 
-                       sigma_clip_high_thresh = high_thresh,
-                       sigma_clip_func = np.ma.median, 
-                       signma_clip_dev_func = mad_std, 
-                       dtype = np.float32,
-                       mem_limit = self._memory_limit)
-              )
+        logger.info(f'sigmaclip combine on {len(self)} images ...')
+        return self._combine(method = 'average',
+                             sigma_clip = True, 
+                             sigma_clip_low_thresh = low_thresh, 
+                             sigma_clip_high_thresh = high_thresh,
+                             sigma_clip_func = np.ma.median, 
+                             signma_clip_dev_func = mad_std)
 
     """
     returns the median frame of frames loaded in this set
     """
     def median(self) -> CCDData:
-        logger.info(f'median combine on {len(self._images)} images ...')
-        return (combine(self._images, 
-                        method = 'median', 
-                        dtype = np.float32, 
-                        mem_limit = self._memory_limit)
-               )
+        logger.info(f'median combine on {len(self)} images ...')
+        return self._combine(method = 'median')
+
+    """
+    returns the shift-and-add (drizzle) frame of frames in this set, on a grid scale times finer
+    frames are not aligned first : sub-pixel shifts are measured by FFT cross-correlation on the reference frame
+    (align_combine.phase_correlation_shift, about 0.01 pixel on noisy star fields)
+    (or given as (y, x) shifts per frame), every pixel shrunk by pixfrac is dropped on the output grid
+    frames are read and processed one at a time (memory is bounded by the output size) - masked pixels are not dropped
+    values keep the input pixel scale : divide by scale² to get flux per output pixel
+    the weight map is kept in drizzle_weights and the shifts in shifts of this set
+    """
+    def drizzle(self, scale: int = 2, pixfrac: float = 1.0, ref_image_index: int = 0, shifts: List[tuple] | None = None) -> CCDData:
+        logger.info(f'drizzle combine on {len(self)} images (scale {scale}, pixfrac {pixfrac}) ...')
+        reference = self._frame(ref_image_index)
+        ref_fft = np.fft.rfft2(np.asarray(reference.data, dtype = np.float32)) if shifts is None else None
+        n_rows, n_cols = reference.shape
+
+        flux = np.zeros((n_rows * scale, n_cols * scale), dtype = np.float32)
+        weights = np.zeros_like(flux)
+        variance = np.zeros_like(flux)
+        propagate_variance = True
+        measured_shifts = []
+        for i in range(len(self)):
+            frame = reference if i == ref_image_index else self._frame(i)
+            data = np.asarray(frame.data, dtype = np.float32)
+            shift = shifts[i] if shifts is not None else (0., 0.) if i == ref_image_index else phase_correlation_shift(ref_fft, data)
+            measured_shifts.append(shift)
+
+            rows = drizzle_matrix(n_rows, shift[0], scale, pixfrac)
+            cols = drizzle_matrix(n_cols, shift[1], scale, pixfrac).T.tocsc()
+            valid = np.ones(data.shape, dtype = np.float32) if frame.mask is None else (~frame.mask).astype(np.float32)
+            flux += (rows @ (data * valid)) @ cols
+            weights += (rows @ valid) @ cols
+
+            ### var(sum a.x) = sum a².var(x)
+            propagate_variance = propagate_variance and frame.uncertainty is not None
+            if propagate_variance:
+                variance += (rows.multiply(rows) @ (calib_utils.get_variance(frame) * valid)) @ cols.multiply(cols)
+            logger.info(f'image {i}: dropped with shift ({shift[0]:.2f}, {shift[1]:.2f})')
+            del frame, data
+
+        covered = weights > 0
+        np.divide(flux, weights, out = flux, where = covered)
+        flux[~covered] = 0
+        header = reference.header.copy()
+        header['NCOMBINE'] = len(self)
+        header['DRIZSCAL'] = (scale, 'drizzle output grid scale')
+        header['DRIZPFRC'] = (pixfrac, 'drizzle pixel fraction')
+        uncertainty = None
+        if propagate_variance:
+            np.divide(variance, np.square(weights), out = variance, where = covered)
+            uncertainty = VarianceUncertainty(variance)
+
+        self.shifts = measured_shifts
+        self.drizzle_weights = weights
+        logger.info('drizzle: complete')
+        return CCDData(flux, unit = reference.unit, header = header, mask = ~covered, uncertainty = uncertainty)
+
+    """
+    combine frames loaded in this set - frames on disk (streaming mode) are combined strip by strip
+    """
+    def _combine(self, method: str, **combine_args) -> CCDData:
+        if len(self._pending) > 0:
+            self._flush()
+
+        if self._files is not None:
+            return self._stream_combine(method, **combine_args)
+
+        combined = combine(self._images,
+                           method = method,
+                           dtype = np.float32,
+                           mem_limit = self._memory_limit,
+                           **combine_args)
+        if all(image.uncertainty is not None for image in self._images):
+            combined.uncertainty = VarianceUncertainty(self._combine_variance(self._images, method, **combine_args))
+        return combined
+
+    """
+    propagate variance planes of frames thru a combine, by row strips sized from max memory
+    pixels rejected by frame masks or by the same sigma clipping as the combine are excluded :
+        sum : sum(var)   average : sum(var) / n²   median : pi/2 * sum(var) / n²  (n : number of pixels kept)
+    """
+    def _combine_variance(self, images: List[CCDData], method: str, sigma_clip: bool = False,
+                          sigma_clip_low_thresh: float = 3, sigma_clip_high_thresh: float = 3,
+                          sigma_clip_func = np.ma.median, sigma_clip_dev_func = np.ma.std, **combine_args) -> np.ndarray:
+        n_rows, n_cols = images[0].shape
+        row_size = 2 * len(images) * n_cols * (2 * np.dtype(np.float32).itemsize + 1)
+        strip_rows = max(1, min(n_rows, int(self._memory_limit // row_size)))
+
+        variance = np.empty((n_rows, n_cols), dtype = np.float32)
+        for y1 in range(0, n_rows, strip_rows):
+            y2 = min(n_rows, y1 + strip_rows)
+            strips = [image[y1:y2] for image in images]
+            if sigma_clip:
+                combiner = Combiner(strips, dtype = np.float32)
+                combiner.sigma_clipping(low_thresh = sigma_clip_low_thresh, high_thresh = sigma_clip_high_thresh,
+                                        func = sigma_clip_func, dev_func = sigma_clip_dev_func)
+                rejected = combiner.data_arr.mask
+            else:
+                rejected = np.stack([np.zeros(strip.shape, dtype = bool) if strip.mask is None else strip.mask for strip in strips])
+
+            ### variance strips are summed in place, one frame at a time
+            strip_variance = variance[y1:y2]
+            strip_variance.fill(0)
+            for strip, strip_rejected in zip(strips, rejected):
+                strip_variance += np.where(strip_rejected, np.float32(0), calib_utils.get_variance(strip))
+            if method != 'sum':
+                strip_variance /= np.square(np.maximum(len(strips) - rejected.sum(axis = 0), 1), dtype = np.float32)
+            if method == 'median':
+                strip_variance *= np.float32(np.pi / 2)
+
+        return variance
+
+    """
+    combine frames kept on disk by row strips : only one strip of every frame is in memory at a time
+    every pixel is combined by the same ccdproc routine as in memory, so results are identical
+    """
+    def _stream_combine(self, method: str, **combine_args) -> CCDData:
+        with fits.open(self._files[0], memmap = True) as hdul:
+            header = hdul[0].header.copy()
+            n_rows, n_cols = hdul[0].shape
+
+        ### same memory model as ccdproc combine : float32 data + uncertainty + mask per pixel
+        memory_factor = (3 if method == 'median' else 2) * 1.3
+        row_size = memory_factor * len(self._files) * n_cols * (2 * np.dtype(np.float32).itemsize + 1)
+        strip_rows = max(1, min(n_rows, int(self._memory_limit // row_size)))
+        logger.info(f'streaming {method} combine : {len(self._files)} frames by strips of {strip_rows} rows')
+
+        data = np.empty((n_rows, n_cols), dtype = np.float32)
+        mask = np.zeros((n_rows, n_cols), dtype = bool)
+        deviation = np.zeros((n_rows, n_cols), dtype = np.float32)
+        for y1 in range(0, n_rows, strip_rows):
+            y2 = min(n_rows, y1 + strip_rows)
+            strip = combine([Images.read_rows(fp, y1, y2) for fp in self._files],
+                            method = method,
+                            dtype = np.float32,
+                            mem_limit = self._memory_limit,
+                            **combine_args)
+            data[y1:y2] = strip.data
+            mask[y1:y2] = strip.mask
+            deviation[y1:y2] = strip.uncertainty.array
+            unit = strip.unit
+            del strip
+
+        if self._noise is not None:
+            ### raw frames : variance strips are built from the noise model, so the combined variance is propagated strip by strip
+            variance = np.empty((n_rows, n_cols), dtype = np.float32)
+            for y1 in range(0, n_rows, strip_rows):
+                y2 = min(n_rows, y1 + strip_rows)
+                variance[y1:y2] = self._combine_variance([self._with_variance(Images.read_rows(fp, y1, y2)) for fp in self._files],
+                                                         method, **combine_args)
+            return CCDData(data, unit = unit, header = header, mask = mask, uncertainty = VarianceUncertainty(variance))
+
+        return CCDData(data, unit = unit, header = header, mask = mask, uncertainty = StdDevUncertainty(deviation))
+
+    """
+    load in memory frames of a streaming set before applying per frame operations
+    """
+    def _load_files(self):
+        if self._files is not None:
+            logger.warning(f'streaming mode : loading {len(self._files)} images in memory ...')
+            self._images = [self._with_variance(CCDData.read(fp, unit = u.Unit('adu'))) for fp in self._files]
+            self._files = None
+
+    """
+    attach a float32 variance plane built from the noise model to a raw frame (no-op without noise model)
+    """
+    def _with_variance(self, image: CCDData) -> CCDData:
+        if self._noise is not None and image.uncertainty is None:
+            image.uncertainty = VarianceUncertainty(calib_utils.create_variance(image.data, *self._noise))
+        return image
+
+    """
+    apply a per frame operation to all frames loaded in this set
+    in deferred mode, the operation is only recorded and will run when a terminal operation is called
+    message is logged with the number of frames
+    """
+    def _map(self, operation: Callable[[CCDData], CCDData], message: str, *inputs):
+        if self._deferred:
+            ### stage key : message (with parameters) and frames used, hashed once for all frames
+            stage_key = None if self._checkpoint is None else cache_utils.chain_key('stage', message, *inputs)
+            self._pending.append((operation, message, stage_key))
+            logger.info(f'deferred : {message.format(len(self))}')
+            return self
+
+        self._load_files()
+        for i in range(0, len(self._images)):
+            self._images[i] = operation(self._images[i])
+
+        logger.info(message.format(len(self._images)))
+        return self
+
+    """
+    run recorded operations as a single pass per frame : every frame goes thru the whole chain
+    and replaces its source before the next one is processed (streaming sets are read one frame at a time)
+    """
+    def _flush(self):
+        if len(self._pending) == 0:
+            self._load_files()
+            return
+
+        logger.info(f'running {len(self._pending)} deferred operations on {len(self)} images ...')
+        if self._files is not None:
+            self._images = [None] * len(self._files)
+
+        for i in range(0, len(self._images)):
+            self._images[i] = self._frame(i)
+
+        for _, message, _ in self._pending:
+            logger.info(message.format(len(self._images)))
+        if self._keys is not None:
+            self._keys = [self._frame_keys(i)[-1] for i in range(len(self._keys))]
+        self._files = None
+        self._pending = []
+
+    """
+    returns frame i with recorded operations applied, without keeping it in this set (streaming frames are read from file)
+    """
+    def _frame(self, i: int) -> CCDData:
+        keys = self._frame_keys(i)
+        start, frame = 0, None
+        ### resume from the last checkpointed operation of this frame
+        for j in range(len(self._pending), 0, -1) if keys is not None else []:
+            frame = cache_utils.load_checkpoint(self._checkpoint, keys[j])
+            if frame is not None:
+                start = j
+                logger.info(f'checkpoint : image {i} resumed after {j}/{len(self._pending)} operations')
+                break
+        if frame is None:
+            frame = self._images[i] if self._files is None else self._with_variance(Images.read_fit(self._files[i]))
+
+        for j in range(start, len(self._pending)):
+            frame = self._pending[j][0](frame)
+            if keys is not None:
+                cache_utils.save_checkpoint(frame, self._checkpoint, keys[j + 1])
+        return frame
+
+    """
+    returns the keys of frame i before and after every recorded operation (None without checkpoint directory)
+    """
+    def _frame_keys(self, i: int) -> List[str] | None:
+        if self._checkpoint is None or self._keys is None:
+            return None
+        keys = [self._keys[i]]
+        for _, _, stage_key in self._pending:
+            keys.append(cache_utils.chain_key(keys[-1], stage_key))
+        return keys
+
+    """
+    returns the set computed by compute, or reloads it if it was checkpointed from the same frames and inputs
+    shifts and failed_frames attributes of the set are checkpointed with its frames
+    """
+    def _checkpointed(self, compute: Callable[[], 'EasyCombiner'], *inputs) -> 'EasyCombiner':
+        if self._checkpoint is None or self._keys is None:
+            return compute()
+
+        set_key = cache_utils.chain_key('set', self._keys, *inputs)
+        attributes = cache_utils.load_attributes(self._checkpoint, set_key)
+        if attributes is not None:
+            frame_keys = [cache_utils.chain_key(set_key, j) for j in range(attributes['frames'])]
+            frames = [cache_utils.load_checkpoint(self._checkpoint, key) for key in frame_keys]
+            if all(frame is not None for frame in frames):
+                logger.info(f'checkpoint : {inputs[0]} of {len(frames)} images reloaded')
+                result = EasyCombiner(frames, self._memory_limit)
+                if 'shifts' in attributes:
+                    result.shifts = [tuple(shift) for shift in attributes['shifts']]
+                result.failed_frames = {int(index): error for index, error in attributes['failed_frames'].items()}
+                result._checkpoint, result._keys = self._checkpoint, frame_keys
+                return result
+
+        result = compute()
+        frame_keys = [cache_utils.chain_key(set_key, j) for j in range(len(result))]
+        for image, key in zip(result._images, frame_keys):
+            cache_utils.save_checkpoint(image, self._checkpoint, key)
+        attributes = {'frames': len(result), 'failed_frames': result.failed_frames}
+        if hasattr(result, 'shifts'):
+            attributes['shifts'] = result.shifts
+        cache_utils.save_attributes(attributes, self._checkpoint, set_key)
+        result._checkpoint, result._keys = self._checkpoint, frame_keys
+        return result
+
+    """
+    returns a function giving the masters with the uncertainty class of a frame (frames read with a noise model carry a variance,
+    combined masters a standard deviation) - masters are converted once per uncertainty class
+    """
+    @staticmethod
+    def _masters_like(*masters) -> Callable[[CCDData], tuple]:
+        converted = {}
+        def like(image: CCDData) -> tuple:
+            kind = type(image.uncertainty)
+            if kind not in converted:
+                converted[kind] = tuple(calib_utils.uncertainty_as(master, kind) for master in masters)
+            return converted[kind]
+        return like
+
+    """
+    record next operations instead of running them (see _flush)
+    """
+    def defer(self):
+        self._deferred = True
+        return self
+
+    """
+    save all frames of this set as FIT files : <directory>/<prefix>-<index>.fit
+    returns the list of file names written
+    """
+    def save(self, directory: str, prefix: str) -> List[str]:
+        self._flush()
+        file_paths = []
+        for i, image in enumerate(self._images):
+            file_paths.append(os.path.join(directory, f'{prefix}-{i + 1:03d}.fit'))
+            image.write(file_paths[-1], overwrite = True)
+
+        logger.info(f'{len(file_paths)} images saved to {directory}')
+        return file_paths
 
     """
     trim all frames loaded in this set
     trim_region is the rectangle : x1, y1, x2, y2 
+    copy = False returns views sharing memory with the source frames (no pixel is copied) : 
+    later operations never write into frames, they return new arrays (batch reduce works on a stacked copy)
     """
-    def trim(self, trim_region: str):
+    def trim(self, trim_region: str, copy: bool = True):
         if trim_region is not None:
-            for i in range(0, len(self._images)):
-                self._images[i] = trim_image(self._images[i][eval(trim_region)[1]:eval(trim_region)[3], eval(trim_region)[0]:eval(trim_region)[2]])
-
-            logger.info(f'{len(self._images)} images trimmed to ({trim_region})')
+            x1, y1, x2, y2 = eval(trim_region)
+            return self._map(Images.crop_operation(y1, y2, x1, x2, copy), '{} images trimmed to ' + f'({trim_region})')
         else:
             logger.info('no trimming')
         return self
@@ -109,8 +486,9 @@ class EasyCombiner(object):
 
     """
     trim all frames loaded in this set on an y-axis position and percentage
+    copy = False returns views sharing memory with the source frames (see trim)
     """        
-    def y_crop(self, y_crop: str | None):
+    def y_crop(self, y_crop: str | None, copy: bool = True):
         # y_crop contains a tuple: y_pos for relative y center, y_ratio for relative crop arround this y center
         y_center = 0.5      # default to middle
         y_ratio = 0.3       # default to 30%
@@ -119,10 +497,11 @@ class EasyCombiner(object):
             y_center, y_ratio= eval(y_crop)
 
         if y_crop is not None:
-            for i in range(0, len(self._images)):
-                x1, x2, y1, y2 = Images.compute_crop(self._images[i], y_center, y_ratio)
-                self._images[i] = trim_image(self._images[i][y1:y2, x1:x2])
-            logger.info(f"{len(self._images)} science images y-cropped to {y1=}, {y2=}")
+            def crop(image):
+                x1, x2, y1, y2 = Images.compute_crop(image, y_center, y_ratio)
+                return Images.crop_operation(y1, y2, x1, x2, copy)(image)
+
+            return self._map(crop, '{} science images y-cropped to ' + f'{y_center=}, {y_ratio=}')
         else:
             logger.info('no y-cropping to do')
         return self
@@ -131,86 +510,210 @@ class EasyCombiner(object):
     add a scalar to all frames loaded in this set
     """
     def offset(self, scalar):
-        for i in range(0, len(self._images)):
-            self._images[i] = CCDData(CCDData.add(self._images[i], scalar), header = self._images[i].header) #, unit = self._images[i].unit
-            
-        logger.info(f'{len(self._images)} images added by ({operand})')
-        return self
+        return self._map(lambda image: CCDData(CCDData.add(image, scalar), header = image.header), #, unit = image.unit
+                         '{} images added by ' + f'({scalar})')
+
     """
     substract a master bias frame to all frames loaded in this set
     """
     def bias_substract(self, frame):
-        for i in range(0, len(self._images)):
-            self._images[i] = subtract_bias(self._images[i], frame)
-            
-        logger.info(f'masterbias substracted to {len(self._images)} images')
-        return self
+        masters = EasyCombiner._masters_like(frame)
+        return self._map(lambda image: subtract_bias(image, masters(image)[0]), 'masterbias substracted to {} images', frame)
 
     """
     substract a master dark frame to all frames loaded in this set
     """
     def dark_substract(self, frame, scale_exposure: bool = True, exposure = 'EXPTIME'):
-        for i in range(0, len(self._images)):
-            self._images[i] = subtract_dark(self._images[i], frame, scale = scale_exposure, exposure_time = exposure, exposure_unit = u.second)                
-        
-        logger.info(f'masterdark substracted to {len(self._images)} images')
-        return self
+        masters = EasyCombiner._masters_like(frame)
+        return self._map(lambda image: subtract_dark(image, masters(image)[0], scale = scale_exposure, exposure_time = exposure, exposure_unit = u.second),
+                         'masterdark substracted to {} images', frame, scale_exposure, exposure)
     
     """
     divide a master flat frame to all frames loaded in this set
     """
     def flat_divide(self, frame):
-        for i in range(0, len(self._images)):
-            self._images[i] = flat_correct(ccd = self._images[i], flat = frame, min_value = None, norm_value = 10000 * u.adu)
-
-        logger.info(f'masterflat divided to {len(self._images)} images')
-        return self
+        masters = EasyCombiner._masters_like(frame)
+        return self._map(lambda image: flat_correct(ccd = image, flat = masters(image)[0], min_value = None, norm_value = 10000 * u.adu),
+                         'masterflat divided to {} images', frame)
 
     """
     process science frames
     masterdark frame is scaled according to science frame exposure duration
+    batch mode calibrates all frames as a single float32 block (see calib_utils) instead of calling ccd_process per frame
     """
-    def reduce(self, master_bias, master_dark, master_flat, exposure_key = 'EXPTIME'):
-        for i in range(0, len(self._images)):
-            self._images[i] = ccd_process(ccd = self._images[i], 
+    def reduce(self, master_bias, master_dark, master_flat, exposure_key = 'EXPTIME', batch: bool = False):
+        if batch:
+            return self._batch_reduce(master_bias, master_dark, master_flat, exposure_key)
+
+        masters = EasyCombiner._masters_like(master_bias, master_dark, master_flat)
+        return self._map(lambda image: ccd_process(ccd = image, 
                 oscan = None, 
                 gain_corrected = True, 
                 trim = None, 
                 error = False,
 #                gain = camera_electronic_gain*u.electron/u.adu ,
 #                readnoise = camera_readout_noise*u.electron,
-                master_bias = master_bias,
-                dark_frame = master_dark,
-                master_flat = master_flat,
+                master_bias = masters(image)[0],
+                dark_frame = masters(image)[1],
+                master_flat = masters(image)[2],
                 exposure_key = exposure_key,
                 exposure_unit = u.second,
-                dark_scale = True)            
+                dark_scale = True),
+            '{} images reduced', master_bias, master_dark, master_flat, exposure_key)
+
+    """
+    batch version of reduce : masters are prepared once, exposure times are read in one pass
+    and frames are calibrated in place - frames of the set become views of the calibrated block
+    """
+    def _batch_reduce(self, master_bias, master_dark, master_flat, exposure_key = 'EXPTIME'):
+        masters = calib_utils.prepare_masters(master_bias, master_dark, master_flat, exposure_key)
+        if self._deferred:
+            def calibrate(image):
+                block = np.asarray(image.data, dtype = np.float32)[np.newaxis].copy()
+                variance = None if image.uncertainty is None else calib_utils.get_variance(image)[np.newaxis].copy()
+                calib_utils.calibrate_block(block, calib_utils.read_exposures([image.header], exposure_key), masters, variance)
+                return CCDData(block[0], unit = image.unit, header = image.header, mask = image.mask,
+                               uncertainty = None if variance is None else VarianceUncertainty(variance[0]))
+
+            return self._map(calibrate, '{} images reduced (batch)', master_bias, master_dark, master_flat, exposure_key)
 
-        logger.info(f'{len(self._images)} images reduced')
+        self._flush()
+        headers = [image.header for image in self._images]
+        block = np.stack([image.data for image in self._images]).astype(np.float32, copy = False)
+        variance = None
+        if all(image.uncertainty is not None for image in self._images):
+            variance = np.stack([calib_utils.get_variance(image) for image in self._images])
+        calib_utils.calibrate_block(block, calib_utils.read_exposures(headers, exposure_key), masters, variance)
+        self._images = [CCDData(block[i], unit = self._images[i].unit, header = headers[i], mask = self._images[i].mask,
+                                uncertainty = None if variance is None else VarianceUncertainty(variance[i])) for i in range(len(block))]
+
+        logger.info(f'{len(self._images)} images reduced (batch)')
+        return self
+
+    """
+    detect cosmic rays (L.A.Cosmic) on all frames loaded in this set and mask them
+    masks are carried by the frames and rejected by median/sigmaclip/sum combines
+    with workers, frames are processed by a process pool - in deferred mode, recorded operations run first
+    masks of frames loaded from files are cached in a .crmasks directory next to the files
+    """
+    def cosmic_clean(self, workers: int | None = None, **lacosmic_args):
+        self._flush()
+        keys = [cache_utils.data_key(image.data, **lacosmic_args) for image in self._images]
+        mask_paths = [None] * len(self._images)
+        if self._sources is not None and len(self._sources) == len(self._images):
+            mask_paths = [os.path.join(os.path.dirname(fp), '.crmasks', os.path.splitext(os.path.basename(fp))[0] + '.fits') 
+                          for fp in self._sources]
+        masks = [cache_utils.load_mask(path, key) if path is not None else None for path, key in zip(mask_paths, keys)]
+        todo = [i for i, mask in enumerate(masks) if mask is None]
+        logger.info(f'cosmic rays : {len(masks) - len(todo)} masks found in cache, {len(todo)} images to clean ...')
+
+        frames = [self._images[i].data for i in todo]
+        if workers is None:
+            new_masks = [_cosmic_worker(data, lacosmic_args) for data in frames]
+        else:
+            with ProcessPoolExecutor(max_workers = workers) as executor:
+                new_masks = list(executor.map(_cosmic_worker, frames, [lacosmic_args] * len(frames)))
+
+        for i, mask in zip(todo, new_masks):
+            masks[i] = mask
+            if mask_paths[i] is not None:
+                cache_utils.save_mask(mask, mask_paths[i], keys[i])
+
+        for i, mask in enumerate(masks):
+            image = self._images[i]
+            image.mask = mask if image.mask is None else (image.mask | mask)
+            logger.info(f'image {i}: {np.count_nonzero(mask)} cosmic ray pixels masked')
+        ### masks change the frames : next checkpoints are keyed with the L.A.Cosmic settings
+        if self._keys is not None:
+            self._keys = [cache_utils.chain_key(key, 'cosmic_clean', lacosmic_args) for key in self._keys]
+
+        logger.info(f'cosmic rays : {len(self._images)} images cleaned')
         return self
 
     """
     align a set of loaded frames - specific to stars fields (astroalign based)
+    with workers, frames are aligned by a process pool : reference stars are detected once and shared with workers
+    frames that cannot be aligned are reported in failed_frames of the returned set (index : error)
     """
-    def star_align(self, ref_image_index: int = 0):
+    def star_align(self, ref_image_index: int = 0, workers: int | None = None):
+        self._flush()
+        if workers is not None:
+            return self._checkpointed(lambda: self._parallel_star_align(ref_image_index, workers), 'star_align', ref_image_index)
+        return self._checkpointed(lambda: self._serial_star_align(ref_image_index), 'star_align', ref_image_index)
+
+    def _serial_star_align(self, ref_image_index: int):
         aligned_images = []
+        failed_frames = {}
+        ### astroalign source detection rejects big endian data (as read from FIT files)
+        native = lambda img: img.data.astype(img.data.dtype.newbyteorder('='), copy = False)
+        reference = native(self._images[ref_image_index])
         #for i, img in tqdm(iterable = zip(range(len(self._images)), self._images), total=len(self._images), desc = 'aligning : '):
         for i, img in zip(range(len(self._images)), self._images):
             logger.info(f'image {i}: aligning to image ref {ref_image_index} ...')
             try: 
-                reg_img, _ = aa.register(img, self._images[ref_image_index])
-                aligned_images.append(CCDData(reg_img, unit = u.adu, header = img.header))
+                source = native(img) if img.mask is None else np.ma.MaskedArray(native(img), mask = img.mask)
+                reg_img, footprint = aa.register(source, reference, propagate_mask = img.mask is not None)
+                aligned_images.append(CCDData(reg_img, unit = u.adu, header = img.header, mask = footprint if img.mask is not None else None))
 
             except Exception as err:
                 logger.error(f"Error {err} : aligning image {i}")
+                failed_frames[i] = repr(err)
                 
         logger.info('align: complete')
-        return EasyCombiner(aligned_images)
+        aligned = EasyCombiner(aligned_images)
+        aligned.failed_frames = failed_frames
+        return aligned
+
+    """
+    process pool version of star_align - results are collected in frames order
+    falls back to the serial version if the astroalign internals used to detect the reference stars are missing
+    """
+    def _parallel_star_align(self, ref_image_index: int, workers: int):
+        reference = self._images[ref_image_index]
+        ### astroalign has no public API to get the control points it detects on an image : serial alignment if its internals changed
+        try:
+            ref_control_points = aa._find_sources(aa._bw(aa._data(reference)), mask = aa._mask(reference))[:aa_max_control_points]
+        except (AttributeError, TypeError) as err:
+            logger.warning(f'align: reference stars detection not available with astroalign {getattr(aa, "__version__", "?")} ({err}) - serial alignment')
+            return self._serial_star_align(ref_image_index)
+        logger.info(f'align: {len(ref_control_points)} reference stars found in image {ref_image_index}')
+
+        aligned_images = []
+        failed_frames = {}
+        with ProcessPoolExecutor(max_workers = workers, 
+                                 initializer = _init_align_worker, 
+                                 initargs = (ref_control_points, reference.shape)) as executor:
+            frames = [None if i == ref_image_index else 
+                      np.asarray(img.data) if img.mask is None else np.ma.MaskedArray(img.data, mask = img.mask)
+                      for i, img in enumerate(self._images)]
+            for i, reg_img, footprint, error in executor.map(_align_worker, range(len(frames)), frames):
+                img = self._images[i]
+                if i == ref_image_index:
+                    aligned_images.append(CCDData(np.asarray(img.data, dtype = np.float64), unit = u.adu, header = img.header, mask = img.mask))
+                elif error is None:
+                    aligned_images.append(CCDData(reg_img, unit = u.adu, header = img.header, mask = footprint if img.mask is not None else None))
+                    logger.info(f'image {i}: aligned to image ref {ref_image_index}')
+                else:
+                    logger.error(f"Error {error} : aligning image {i}")
+                    failed_frames[i] = error
+
+        logger.info(f'align: complete - {len(failed_frames)} image(s) failed {list(failed_frames)}')
+        aligned = EasyCombiner(aligned_images)
+        aligned.failed_frames = failed_frames
+        return aligned
 
     """
     align a set of loaded frames - specific to spectra fields (fft based)
+    method 'phase' : FFT cross-correlation with the reference transform computed once and a sub-pixel peak fit,
+    shifts applied by shift_method : 'bilinear' (borders set to 0) or 'fourier' (no smoothing, but edges wrap around)
     """
-    def spec_align(self, ref_image_index: int = 0):    
+    def spec_align(self, ref_image_index: int = 0, method: str = 'fftconvolve', shift_method: str = 'bilinear'):    
+        self._flush()
+        if method == 'phase':
+            return self._checkpointed(lambda: self._phase_align(ref_image_index, shift_method), 'spec_align', ref_image_index, method, shift_method)
+        return self._checkpointed(lambda: self._fft_align(ref_image_index), 'spec_align', ref_image_index, method)
+
+    def _fft_align(self, ref_image_index: int):
         ### Collect arrays and crosscorrelate all (except the first) with the first.
         logger.info('align: fftconvolve running...')
         nX, nY = self._images[ref_image_index].shape
@@ -237,74 +740,286 @@ class EasyCombiner(object):
     
         ### Roll the images to realign them and return their median.
         logger.info('align: images realignement ...')
-        realigned_images = [CCDData(np.roll(image, deltas[i], axis=(0, 1)).data.astype('float32'), unit = u.adu, header = image.header) 
+        realigned_images = [CCDData(np.roll(image.data, deltas[i], axis=(0, 1)).astype('float32'), unit = u.adu, header = image.header,
+                                    mask = None if image.mask is None else np.roll(image.mask, deltas[i], axis=(0, 1)),
+                                    uncertainty = None if image.uncertainty is None else 
+                                        VarianceUncertainty(np.roll(calib_utils.get_variance(image), deltas[i], axis=(0, 1)))) 
                             for (i, image) in enumerate(self._images[1:])]
 
         ### do not forget the reference image
-        realigned_images.append(CCDData(self._images[ref_image_index].data.astype('float32'), unit = u.adu, header = self._images[ref_image_index].header))
+        reference = self._images[ref_image_index]
+        realigned_images.append(CCDData(reference.data.astype('float32'), unit = u.adu, header = reference.header, mask = reference.mask,
+                                        uncertainty = None if reference.uncertainty is None else VarianceUncertainty(calib_utils.get_variance(reference))))
         logger.info('align: complete')
         return EasyCombiner(realigned_images)
 
+    """
+    FFT cross-correlation version of spec_align - the sub-pixel shifts (y, x) are kept in shifts of the returned set
+    """
+    def _phase_align(self, ref_image_index: int, shift_method: str):
+        logger.info('align: cross-correlation running...')
+        reference = self._images[ref_image_index]
+        shifts = phase_correlation_shifts(reference.data, [image.data for image in self._images])
+        logger.info('align: images shifts = ' + repr([(round(dy, 2), round(dx, 2)) for dy, dx in shifts]))
+
+        ### Warn for ghost images if realignment requires shifting by more than
+        ### 15% of the field size.
+        nX, nY = reference.shape
+        t_frac = max(max(abs(dy) / nX, abs(dx) / nY) for dy, dx in shifts)
+        if t_frac > 0.15:
+            logger.warning('align: shifting by {}% of the field size'.format(int(100 * t_frac)))
+
+        logger.info('align: images realignement ...')
+        ### variance planes are shifted bilinearly : fourier shifts could make them negative
+        realigned_images = [CCDData(shift_image(image.data, shifts[i], shift_method), unit = u.adu, header = image.header,
+                                    mask = None if image.mask is None else shift_image(image.mask, shifts[i], 'bilinear') > 0,
+                                    uncertainty = None if image.uncertainty is None else
+                                        VarianceUncertainty(shift_image(calib_utils.get_variance(image), shifts[i], 'bilinear').astype(np.float32)))
+                            if i != ref_image_index else
+                            CCDData(image.data.astype('float32'), unit = u.adu, header = image.header, mask = image.mask,
+                                    uncertainty = None if image.uncertainty is None else VarianceUncertainty(calib_utils.get_variance(image)))
+                            for (i, image) in enumerate(self._images)]
+        logger.info('align: complete')
+        aligned = EasyCombiner(realigned_images)
+        aligned.shifts = shifts
+        return aligned
+
 """
 Images class implements the images loader methods
 
 """
 class Images(EasyCombiner):
-    def __init__(self, images: List[CCDData]):
-        EasyCombiner.__init__(self, images)
+    def __init__(self, images: List[CCDData], max_memory: float = 4e9, files: List[str] | None = None, deferred: bool = False):
+        EasyCombiner.__init__(self, images, max_memory, files, deferred)
 
     """
     collect and sort (according to fit header 'date-obs') file names using a wildcard filter
+    with workers, headers are read by a thread pool - ties and missing keys are ordered by file name
+    with use_index, headers are read from the directory headers index (see header_index), re-read only for changed files
     """
     @classmethod
-    def find_files(cls, directory: str, files_filter: str, sort_key: str = 'date-obs') -> List[str]:
-        ic = ImageFileCollection(directory, glob_include = files_filter)
-        ic.sort([sort_key])
-        return (ic.files_filtered(include_path=True))
+    def find_files(cls, directory: str, files_filter: str, sort_key: str = 'date-obs', workers: int | None = None, use_index: bool = False) -> List[str]:
+        if use_index:
+            return HeaderIndex(directory, workers = workers or 4).query(files_filter, sort_key)
+
+        if workers is None:
+            ic = ImageFileCollection(directory, glob_include = files_filter)
+            if len(ic.files) == 0:
+                return []
+            ic.sort([sort_key])
+            return (ic.files_filtered(include_path=True))
+
+        file_paths = sorted(os.path.join(directory, name) for name in fnmatch.filter(os.listdir(directory), files_filter)
+                            if os.path.isfile(os.path.join(directory, name)))
+        with ThreadPoolExecutor(max_workers = workers) as executor:
+            sort_values = list(executor.map(lambda fp: fits.getheader(fp).get(sort_key), file_paths))
+
+        ### files without sort key go last, as with ImageFileCollection masked values
+        return [fp for _, fp in sorted(zip(sort_values, file_paths), key = lambda kv: (kv[0] is None, str(kv[0]), kv[1]))]
 
     """
     load a set of FIT images
-    create deviation metadata from the gain & readnoise provided
+    with uncertainty, frames carry a float32 variance plane built from the gain & readnoise provided
+    streaming mode only collects file names : frames are read by strips when combined
+    workers sets the number of threads reading files in parallel (None : serial read)
+    deferred mode records next operations and runs them in a single pass per frame (see EasyCombiner)
+    checkpoint is a scratch directory where frames are saved after every operation (deferred mode, see EasyCombiner)
     """
     @classmethod
     def from_fit(cls, dir: str, filter: str, 
                  camera_electronic_gain: float = 1.2 * u.electron / u.adu, 
-                 camera_readout_noise: float =  2.2 * u.electron):
+                 camera_readout_noise: float =  2.2 * u.electron,
+                 streaming: bool = False,
+                 max_memory: float = 4e9,
+                 workers: int | None = None,
+                 deferred: bool = False,
+                 uncertainty: bool = False,
+                 checkpoint: str | None = None):
         
-        images = []
-        for fp in Images.find_files(directory = dir, files_filter = filter):
-            #images.append(create_deviation(CCDData.read(fp, unit = u.adu),
-             #                              gain = camera_electronic_gain,
-              #                             readnoise = camera_readout_noise,
-               #                            disregard_nan = True
-                #                          ))
-            images.append(CCDData.read(fp, unit = u.Unit('adu')))
-            logger.info(f'image : {fp} loaded')
-        return cls(images)
+        noise = None
+        if uncertainty:
+            noise = (u.Quantity(camera_electronic_gain, u.electron / u.adu).value, u.Quantity(camera_readout_noise, u.electron).value)
+
+        files = Images.find_files(directory = dir, files_filter = filter, workers = workers)
+        if checkpoint is not None:
+            ### frames stay on disk until a terminal operation : checkpointed ones are never read again
+            logger.info(f'checkpoint mode : {len(files)} images found - checkpoints in {checkpoint}')
+            loaded = cls([], max_memory, files, deferred = True)
+            loaded._noise = noise
+            loaded._checkpoint = checkpoint
+            loaded._keys = [cache_utils.inputs_key([fp], noise = noise) for fp in files]
+            return loaded
 
+        if streaming:
+            logger.info(f'streaming mode : {len(files)} images found')
+            loaded = cls([], max_memory, files, deferred)
+            loaded._noise = noise
+            return loaded
+
+        start_time = time.perf_counter()
+        if workers is None:
+            images = [Images.read_fit(fp) for fp in files]
+        else:
+            ### reads overlap across threads - map() keeps the 'date-obs' order
+            with ThreadPoolExecutor(max_workers = workers) as executor:
+                images = list(executor.map(Images.read_fit, files))
+
+        elapsed = time.perf_counter() - start_time
+        total_size = sum(os.path.getsize(fp) for fp in files) / 1e6
+        logger.info(f'{len(images)} images loaded in {elapsed:.2f}s ({total_size / max(elapsed, 1e-9):.1f} MB/s)')
+        loaded = cls(images, max_memory, deferred = deferred)
+        loaded._sources = files
+        loaded._noise = noise
+        loaded._images = [loaded._with_variance(image) for image in images]
+        return loaded
+
+    """
+    build a master frame (eg. masterbias.fit) from a set of FIT images, or load it from output if its inputs did not change
+    the cache key covers the files list with their size and modified time, the trim region, the combine and the uncertainty parameters
+    """
     @classmethod
-    def from_rgb(cls, file_paths: List[str]):
-        images = []
-        ### TODO ...
-        return cls(images)
+    def master_from_fit(cls, dir: str, filter: str, output: str, 
+                        trim_region: str | None = None, 
+                        method: str = 'sigmaclip', 
+                        combine_args: dict | None = None, 
+                        **load_args) -> CCDData:
+        combine_args = combine_args or {}
+        files = Images.find_files(directory = dir, files_filter = filter, workers = load_args.get('workers'))
+        ### loading parameters changing the master pixels (uncertainty, noise model) are part of the key, not the execution ones (workers, streaming...)
+        defaults = inspect.signature(cls.from_fit).parameters
+        noise_args = {name: load_args.get(name, defaults[name].default)
+                      for name in ('uncertainty', 'camera_electronic_gain', 'camera_readout_noise')}
+        key = cache_utils.inputs_key(files, trim_region = trim_region, method = method, combine_args = combine_args,
+                                     load_args = noise_args)
+        master = cache_utils.load_master(output, key)
+        if master is not None:
+            logger.info(f'master {output} is up to date ({len(files)} images)')
+            return master
 
+        logger.info(f'building master {output} from {len(files)} images ...')
+        master = getattr(cls.from_fit(dir, filter, **load_args).trim(trim_region), method)(**combine_args)
+        cache_utils.save_master(master, output, key)
+        return master
+
+    """
+    read a FIT image - logs the file read throughput
+    """
     @classmethod
-    def from_png(cls, file_paths: List[str]):
-        images = []
-        ### TODO ...
-        return cls(images)
+    def read_fit(cls, file_path: str) -> CCDData:
+        start_time = time.perf_counter()
+        image = CCDData.read(file_path, unit = u.Unit('adu'))
+        elapsed = time.perf_counter() - start_time
+        file_size = os.path.getsize(file_path) / 1e6
+        logger.info(f'image : {file_path} loaded ({file_size:.1f} MB in {elapsed:.3f}s - {file_size / max(elapsed, 1e-9):.1f} MB/s)')
+        return image
 
+    """
+    read rows y1 to y2 of a FIT image - memory-mapped unless scaled (BZERO/BSCALE) data prevents it
+    """
     @classmethod
-    def from_jpg(cls, file_paths: List[str]):
-        images = []
-        ### TODO ...
-        return cls(images)
+    def read_rows(cls, file_path: str, y1: int, y2: int) -> CCDData:
+        with fits.open(file_path, memmap = True) as hdul:
+            header = hdul[0].header
+            scaled = any(key in header for key in ('BZERO', 'BSCALE', 'BLANK'))
+            if not scaled:
+                return CCDData(np.array(hdul[0].section[y1:y2]), unit = u.Unit('adu'), header = header.copy())
+
+        ### section reads only the requested rows from the file
+        with fits.open(file_path, memmap = False) as hdul:
+            return CCDData(hdul[0].section[y1:y2], unit = u.Unit('adu'), header = hdul[0].header.copy())
 
+    """
+    load a set of colour image files (PNG, JPEG, TIFF) split into 3 sets : red, green and blue frames
+    bayer is the matrix pattern (eg. 'RGGB') of raw mono frames to debayer (see rgb_utils.split_channel)
+    files are decoded by a thread pool, every file is decoded once for the 3 channels
+    mono files without bayer pattern raise ValueError (they have no colour channels)
+    """
+    @classmethod
+    def from_rgb(cls, file_paths: List[str], bayer: str | None = None, workers: int | None = 4, max_memory: float = 4e9) -> Tuple:
+        decoded = Images._decode(file_paths, workers)
+        if bayer is None:
+            mono = [fp for fp, (data, _) in zip(file_paths, decoded) if data.ndim == 2]
+            if len(mono) > 0:
+                raise ValueError(f'{len(mono)} mono image(s) without bayer pattern (eg. {mono[0]}) - set bayer or use from_png/from_tiff')
+        return tuple(cls([CCDData(rgb_utils.split_channel(data, channel, bayer), unit = u.adu, header = Images._channel_header(header, channel, bayer))
+                          for data, header in decoded], max_memory)
+                     for channel in rgb_channels)
+
+    """
+    load a set of PNG images as float32 frames of one channel ('L' : sum of channels, 'R', 'G' or 'B')
+    16 bits mono images keep their native values (no rescaling to [0, 1]) - 16 bits colour PNG raise ValueError (see rgb_utils.read_image)
+    """
     @classmethod
-    def from_tiff(cls, file_paths: List[str]):
-        images = []
-        ### TODO ...
-        return cls(images)
+    def from_png(cls, file_paths: List[str], channel: str = 'L', bayer: str | None = None, workers: int | None = 4, max_memory: float = 4e9):
+        return cls._from_image(file_paths, channel, bayer, workers, max_memory)
+
+    """
+    load a set of JPEG images as float32 frames of one channel (see from_png)
+    """
+    @classmethod
+    def from_jpg(cls, file_paths: List[str], channel: str = 'L', bayer: str | None = None, workers: int | None = 4, max_memory: float = 4e9):
+        return cls._from_image(file_paths, channel, bayer, workers, max_memory)
+
+    """
+    load a set of TIFF images as float32 frames of one channel (see from_png)
+    16 bits mono and colour images keep their native values
+    """
+    @classmethod
+    def from_tiff(cls, file_paths: List[str], channel: str = 'L', bayer: str | None = None, workers: int | None = 4, max_memory: float = 4e9):
+        return cls._from_image(file_paths, channel, bayer, workers, max_memory)
+
+    @classmethod
+    def _from_image(cls, file_paths: List[str], channel: str, bayer: str | None, workers: int | None, max_memory: float):
+        images = [CCDData(rgb_utils.split_channel(data, channel, bayer), unit = u.adu, header = Images._channel_header(header, channel, bayer))
+                  for data, header in Images._decode(file_paths, workers)]
+        return cls(images, max_memory)
+
+    @classmethod
+    def _decode(cls, file_paths: List[str], workers: int | None) -> List[tuple]:
+        """
+        decode image files, in a thread pool if workers is set (decoders release the GIL) - files order is kept
+        """
+        start_time = time.perf_counter()
+        if workers is None:
+            decoded = [rgb_utils.read_image(fp) for fp in file_paths]
+        else:
+            with ThreadPoolExecutor(max_workers = workers) as executor:
+                decoded = list(executor.map(rgb_utils.read_image, file_paths))
+
+        elapsed = time.perf_counter() - start_time
+        total_size = sum(os.path.getsize(fp) for fp in file_paths) / 1e6
+        logger.info(f'{len(decoded)} images decoded in {elapsed:.2f}s ({total_size / max(elapsed, 1e-9):.1f} MB/s)')
+        return decoded
+
+    @classmethod
+    def _channel_header(cls, header: fits.Header, channel: str, bayer: str | None) -> fits.Header:
+        header = header.copy()
+        header['FILTER'] = channel
+        if bayer is not None:
+            header['BAYERPAT'] = (bayer, 'debayered by superpixel')
+        return header
+
+    @classmethod
+    def crop_operation(cls, y1: int, y2: int, x1: int, x2: int, copy: bool = True) -> Callable[[CCDData], CCDData]:
+        """
+        returns the per frame crop operation of a region
+
+        Args:
+            y1, y2, x1, x2 (int): region to crop to (python slices)
+            copy (bool, optional): copy pixels (trim_image) or return a view of the source frame. Defaults to True.
+
+        Returns:
+            Callable[[CCDData], CCDData]: crop operation
+        """
+        if copy:
+            return lambda image: trim_image(image[y1:y2, x1:x2])
+
+        ### CCDData slicing shares data, mask and uncertainty arrays with the source frame
+        def crop_view(image: CCDData) -> CCDData:
+            view = image[y1:y2, x1:x2]
+            view.meta = image.meta.copy()
+            return view
+        return crop_view
 
     @classmethod
     def compute_crop(cls, img:CCDData, y_center: float = 0.5, y_ratio: float = 0.3) -> tuple[float, float, float, float]:
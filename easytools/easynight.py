@@ -0,0 +1,219 @@
+""" EasyNight : headless reduction of a whole observing night, without jupyter
+
+the night is described by a YAML file (see EasyNight.yaml) :
+    - masters (bias, dark, flat, calib lamp) are built once - and reused as long as their files do not change
+    - every target is then reduced, aligned, combined, traced, extracted and wavelength calibrated
+      in its own process, targets running in parallel on the available cores
+    - results (<target>-reduced.fit, <target>-1D.dat) are written to the processed directory (preprocess ppr_processed)
+a JSON report gives the timings of every stage of every target.
+
+usage :
+        python easynight.py EasyNight.yaml
+        python easynight.py night.yaml --workers 8 --targets markab agdra --report report.json
+"""
+import os, sys, time, json, argparse, logging, traceback
+from concurrent.futures import ProcessPoolExecutor
+import yaml
+import numpy as np
+from astropy import units as u
+from ccdproc import subtract_bias
+from logger_utils import logger, CustomFormatter
+from easycombiner import Images
+
+### night description and masters shared by worker processes (set once per process)
+_night = {}
+
+def _console_logging(log_level: str) -> None:
+    """
+    headless runs log to stderr instead of the jupyter output widget
+    """
+    if not any(isinstance(log_handler, logging.StreamHandler) for log_handler in logger.handlers):
+        console = logging.StreamHandler(sys.stderr)
+        console.setFormatter(CustomFormatter())
+        logger.addHandler(console)
+    logger.setLevel(log_level)
+
+def _init_worker(night: dict, masters: dict) -> None:
+    _night['config'] = night
+    _night['masters'] = masters
+    _console_logging(night['global'].get('log_level', 'INFO'))
+
+def load_night(night_file: str) -> dict:
+    """
+    read the night description - paths are relative to global root_path
+    """
+    with open(night_file, 'r') as cfg_file:
+        night = yaml.safe_load(cfg_file)
+    for section in ('global', 'preprocess', 'masters', 'reduce', 'extract', 'calibrate'):
+        night.setdefault(section, {})
+    night.setdefault('targets', [])
+    return night
+
+def _load_args(night: dict) -> dict:
+    preprocess = night['preprocess']
+    return {'uncertainty': preprocess.get('uncertainty', False),
+            'camera_electronic_gain': preprocess.get('camera_electronic_gain', 1.2) * u.electron / u.adu,
+            'camera_readout_noise': preprocess.get('camera_readout_noise', 2.2) * u.electron}
+
+def build_masters(night: dict) -> tuple[dict, dict]:
+    """
+    build (or reload from cache) master frames - dark, flat and calib masters are bias substracted
+    returns the masters and their build timings
+    """
+    root_path = night['global']['root_path']
+    trim_region = night['preprocess'].get('trim_region')
+    masters, timings = {}, {}
+    for name in ('bias', 'dark', 'flat', 'calib'):
+        description = night['masters'].get(name)
+        if description is None:
+            masters[name] = None
+            continue
+        start_time = time.perf_counter()
+        master = Images.master_from_fit(root_path, description['filter'], os.path.join(root_path, description['output']),
+                                        trim_region = trim_region, method = description.get('method', 'sigmaclip'),
+                                        **_load_args(night))
+        if name != 'bias' and masters['bias'] is not None:
+            master = subtract_bias(master, masters['bias'])
+        masters[name] = master
+        timings[name] = round(time.perf_counter() - start_time, 3)
+        logger.info(f'night : master {name} ready ({timings[name]}s)')
+    return masters, timings
+
+def reduce_target(target: dict) -> dict:
+    """
+    reduce one target in a worker process - returns its report (stages timings, outputs, error if any)
+    """
+    from astropy.modeling import models, fitting
+    from specreduce.tracing import FitTrace
+    from specreduce.background import Background
+    from specreduce.extract import BoxcarExtract
+    from specreduce import WavelengthCalibration1D
+
+    night, masters = _night['config'], _night['masters']
+    root_path = night['global']['root_path']
+    output_path = os.path.join(root_path, night['preprocess'].get('ppr_processed', '_ppr'))
+    os.makedirs(output_path, exist_ok = True)
+    reduce_cfg = {**night['reduce'], **target.get('reduce', {})}
+    extract_cfg = {**night['extract'], **target.get('extract', {})}
+    calibrate_cfg = night['calibrate']
+    name = target['name']
+    report = {'target': name, 'frames': 0, 'stages': {}, 'outputs': [], 'error': None}
+
+    def timed(stage: str, operation):
+        start_time = time.perf_counter()
+        result = operation()
+        report['stages'][stage] = round(time.perf_counter() - start_time, 3)
+        return result
+
+    try:
+        if reduce_cfg.get('combine', 'median') == 'drizzle' and masters['calib'] is not None and 'pixels' in calibrate_cfg:
+            ### the drizzled frame is on a finer grid than the lamp frame and the calibration line pixels
+            raise ValueError('drizzle combine cannot be wavelength calibrated - use median, sigmaclip or sum')
+
+        images = timed('load', lambda: Images.from_fit(root_path, target['filter'], **_load_args(night)))
+        report['frames'] = len(images)
+        if len(images) == 0:
+            raise ValueError(f'no image matches {target["filter"]}')
+
+        images = timed('reduce', lambda: images.trim(night['preprocess'].get('trim_region'))
+                                             .reduce(masters['bias'], masters['dark'], masters['flat'],
+                                                     reduce_cfg.get('exposure_key', 'EXPTIME'), batch = reduce_cfg.get('batch', True)))
+
+        align = reduce_cfg.get('align', 'phase')
+        if align == 'star':
+            images = timed('align', lambda: images.star_align())
+        elif align in ('phase', 'fftconvolve'):
+            images = timed('align', lambda: images.spec_align(method = align))
+
+        master_science = timed('combine', lambda: getattr(images, reduce_cfg.get('combine', 'median'))())
+        del images
+        output = os.path.join(output_path, f'{name}-reduced.fit')
+        master_science.write(output, overwrite = True)
+        report['outputs'].append(output)
+
+        trace = timed('trace', lambda: FitTrace(master_science,
+                                                bins = extract_cfg.get('trace_bins', 12),
+                                                trace_model = models.Polynomial1D(degree = extract_cfg.get('trace_degree', 2)),
+                                                peak_method = extract_cfg.get('peak_method', 'gaussian'),
+                                                window = extract_cfg.get('window', 20)))
+
+        def extract():
+            background = Background.two_sided(master_science, trace,
+                                              separation = extract_cfg.get('background_separation', 20),
+                                              width = extract_cfg.get('background_width', 10))
+            return BoxcarExtract(master_science - background, trace, width = extract_cfg.get('width', 5))()
+        spectrum = timed('extract', extract)
+
+        if masters['calib'] is not None and 'pixels' in calibrate_cfg:
+            def calibrate():
+                lamp_spectrum = BoxcarExtract(masters['calib'], trace, width = extract_cfg.get('width', 5))()
+                calibration = WavelengthCalibration1D(input_spectrum = lamp_spectrum,
+                                                      line_pixels = calibrate_cfg['pixels'] * u.pix,
+                                                      line_wavelengths = calibrate_cfg['wavelengths'] * u.AA,
+                                                      input_model = models.Polynomial1D(degree = calibrate_cfg.get('degree', 2)),
+                                                      fitter = fitting.LinearLSQFitter())
+                report['calibration_rms'] = float(np.sqrt(np.mean(np.square(calibration.residuals.value))))
+                return calibration.apply_to_spectrum(spectrum)
+            spectrum = timed('calibrate', calibrate)
+
+        ### 2 columns (wavelength or pixel, flux) format, as easyextract does
+        output = os.path.join(output_path, f'{name}-1D.dat')
+        np.savetxt(output, np.array([spectrum.spectral_axis.value, spectrum.flux.value]).T)
+        report['outputs'].append(output)
+
+    except Exception as err:
+        logger.error(f'night : {name} failed ({err})')
+        report['error'] = repr(err)
+        report['traceback'] = traceback.format_exc()
+
+    report['total_s'] = round(sum(report['stages'].values()), 3)
+    logger.info(f'night : {name} done in {report["total_s"]}s')
+    return report
+
+def run(night_file: str, workers: int | None = None, selected: list | None = None) -> dict:
+    """
+    reduce all targets of a night (or the selected ones) - returns the report as a dict
+    """
+    night = load_night(night_file)
+    _console_logging(night['global'].get('log_level', 'INFO'))
+    workers = workers or night['global'].get('workers') or os.cpu_count()
+    targets = [target for target in night['targets'] if selected is None or target['name'] in selected]
+
+    start_time = time.perf_counter()
+    masters, masters_timings = build_masters(night)
+    logger.info(f'night : {len(targets)} targets on {workers} workers ...')
+    ### every worker reduces one target at a time : frames of a target are processed serially to avoid oversubscription
+    with ProcessPoolExecutor(max_workers = workers, initializer = _init_worker, initargs = (night, masters)) as executor:
+        reports = list(executor.map(reduce_target, targets))
+
+    return {
+        'meta': {
+            'night': os.path.abspath(night_file),
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'workers': workers,
+            'wall_s': round(time.perf_counter() - start_time, 3),
+            'masters_s': masters_timings,
+            'failed': [report['target'] for report in reports if report['error'] is not None],
+        },
+        'targets': reports,
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'headless reduction of a whole night of spectra')
+    parser.add_argument('night', help = 'YAML night description (see EasyNight.yaml)')
+    parser.add_argument('--workers', type = int, default = None, help = 'targets reduced in parallel (default : global workers, or cpu count)')
+    parser.add_argument('--targets', nargs = '+', default = None, help = 'names of the targets to reduce (default : all)')
+    parser.add_argument('--report', default = None, help = 'JSON report file (default : global report, relative to root_path)')
+    args = parser.parse_args()
+
+    report = run(args.night, args.workers, args.targets)
+    night_global = load_night(args.night)['global']
+    report_path = args.report or os.path.join(night_global['root_path'], night_global.get('report', 'night-report.json'))
+    with open(report_path, 'w') as report_file:
+        json.dump(report, report_file, indent = 2)
+
+    for target in report['targets']:
+        stages = ', '.join(f'{stage} {seconds}s' for stage, seconds in target['stages'].items())
+        print(f'{target["target"]:<20} {target["frames"]:>4} frames  {target["total_s"]:>8}s  {"FAILED " + target["error"] if target["error"] else stages}')
+    print(f'report : {report_path}')
+    sys.exit(1 if report['meta']['failed'] else 0)
@@ -19,6 +19,10 @@
 """
 from files_utils import *
 from logger_utils import logger, handler
+from dir_watcher import DirWatcher
+from stats_utils import stats_utils
+from display_pyramid import DisplayPyramid
+from prefetcher import Prefetcher
 from ipyfilechooser import FileChooser
 from IPython.display import display
 import ipywidgets as widgets
@@ -28,7 +32,9 @@ import matplotlib.pyplot as plt
 from matplotlib import colormaps
 import matplotlib.transforms as mtransforms
 from scipy import ndimage
-import math
+import math, asyncio
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 class EasySpec(object):   
     def __init__(self, root_path: str = None) -> None:
@@ -54,6 +60,18 @@ class EasySpec(object):
             raise                 
             
         self.saved_data = self.primary_data.copy()
+
+        ### full resolution geometry results, computed in background and cached by (image, rotate, crop, skew)
+        self.geometry_cache = OrderedDict()
+        self.geometry_key = None
+        self.geometry_executor = ThreadPoolExecutor(max_workers = 1)
+        try:
+            self.loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.loop = None
+
+        ### files next to the selected one are decoded in background
+        self.prefetcher = Prefetcher(self.__prefetch, neighbours = int(self.config['viewer'].get('prefetch', 2)))
         
         ### create all GUI components
         self.__create_logger_gui()
@@ -65,10 +83,13 @@ class EasySpec(object):
         self.__create_browser_gui()
         self.__create_viewer_gui()
 
-        ### monitors new files in background
-        self.watch_thread = threading.Thread(target = self.__watch_files, name='EASYSPEC_watch_thread')
-        self.watch_thread.start()
-        logger.debug('watch thread started - tid = {}'.format(self.watch_thread))          
+        ### monitors directory changes in background (file system events, or polling if watchdog is not installed)
+        self.watcher = DirWatcher(self.__files_changed)
+        self.watcher.watch(self.dir_select.selected_path)
+        self.dir_select.register_callback(lambda chooser: self.watcher.watch(chooser.selected_path))
+        self.files_filter.observe(lambda change: self.__refresh_files(), names = 'value')
+        self.auto_refresh.observe(lambda change: self.__refresh_files(), names = 'value')
+        logger.debug('watcher started - {}'.format(self.watcher.path))
 
     def __create_logger_gui(self) -> None:
         """ 
@@ -156,17 +177,26 @@ class EasySpec(object):
         ### on_file_clic : display infos
         self.files_select.observe(self.display_infos, names = 'value')
 
-    def __watch_files(self) -> None:
+    def __files_changed(self, events: list) -> None:
+        """ 
+        directory watcher callback (runs on the notebook event loop) : events are lists of (added|removed|modified, file name)
+        """        
+        if not self.auto_refresh.value:
+            return
+        self.__refresh_files()
+        if self.display_new.value:
+            added = set(name for kind, name in events if kind == 'added')
+            newest = [name for name in self.files_select.options if name in added]
+            if len(newest) > 0:
+                self.files_select.value = newest[0]
+
+    def __refresh_files(self) -> None:
         """ 
-        watch every sec newly created files - update list files widget contents
+        update list files widget contents from the watched directory listing (no directory scan)
         """        
         if self.auto_refresh.value:
-            while True:
-                #logger.debug('refreshing list of files...')
-                self.files_select.options = files_utils.list_files(self.dir_select.selected_path, self.files_filter.value)
-                time.sleep(1)
-        
-            
+            self.files_select.options = self.watcher.files(self.files_filter.value)
+
     def __create_viewer_gui(self) -> None:
         """ 
         creates viewer panels
@@ -190,11 +220,12 @@ class EasySpec(object):
             ### show image 2D
             self.ax_img.axis('off')
             self.ax_img.set_yscale('linear')
+            stats = self.image_stats()
             self.img = self.ax_img.imshow(
                 self.primary_data, 
                 origin = 'lower', 
-                vmin = self.primary_data.min(), 
-                vmax = self.primary_data.max(), 
+                vmin = stats['min'], 
+                vmax = stats['max'], 
                 interpolation='none',
                 aspect = 'equal',
                 cmap = 'magma'
@@ -205,6 +236,14 @@ class EasySpec(object):
                 
             self.ax_img.format_coord=format_coord
 
+            ### large frames are drawn through their display pyramid : pan & zoom only redraw the visible window
+            self.pyramid = None
+            ### pyramid of the saved image, kept for the geometry previews
+            self.saved_pyramid = None
+            self.ax_img.callbacks.connect('xlim_changed', self.update_view)
+            self.ax_img.callbacks.connect('ylim_changed', self.update_view)
+            self.display_image()
+
             __color_bar = self.fig_img.colorbar(self.img, ax = self.ax_img, location='left')
 
             '''
@@ -323,11 +362,14 @@ class EasySpec(object):
         """        
         if (self.dir_select.selected_path is not None) and (change['new'] is not None):
             self.selected_file = self.dir_select.selected_path + os.sep + change['new']
-            self.fit_header.value = str(files_utils.get_file_info(self.selected_file))
+            fit_header, naxis, self.primary_data = files_utils.get_file(self.selected_file)
+            self.fit_header.value = str((fit_header, naxis))
             logger.info('Selected file : {}'.format(self.selected_file))
-            self.primary_data = files_utils.get_file_data(self.selected_file)
-            self.saved_data = self.primary_data.copy()
+            ### cached data is read-only : shared as is (transformations never change it in place)
+            self.saved_data = self.primary_data
+            self.saved_pyramid = None
             #self.apply_display_changes(self.selected_file)
+            self.prefetcher.around(self.dir_select.selected_path, list(self.files_select.options), change['new'])
         else:
             logger.info('No file selected')
 
@@ -337,6 +379,51 @@ class EasySpec(object):
         self.fig_histo.canvas.draw_idle()
 
     
+    def display_image(self) -> None:
+        """ 
+        show the whole image - its display pyramid is built once per image
+        """        
+        if self.pyramid is None or self.pyramid.data is not self.primary_data:
+            if self.saved_pyramid is not None and self.saved_pyramid.data is self.primary_data:
+                self.pyramid = self.saved_pyramid
+            else:
+                self.pyramid = DisplayPyramid(self.primary_data)
+        self.pyramid.reset()
+        self.ax_img.set_autoscale_on(False)
+        self.ax_img.set_xlim(0, self.primary_data.shape[1])
+        self.ax_img.set_ylim(0, self.primary_data.shape[0])
+        self.update_view()
+
+    def update_view(self, ax = None) -> None:
+        """ 
+        pan/zoom callback : draw the pyramid window matching the visible region and the canvas size
+        """        
+        if self.pyramid is None:
+            return
+        x0, x1 = self.ax_img.get_xlim()
+        y0, y1 = self.ax_img.get_ylim()
+        canvas = self.ax_img.get_window_extent()
+        window, extent = self.pyramid.view(x0, x1, y0, y1, canvas.width, canvas.height)
+        if window is not None:
+            self.img.set_data(window)
+            self.img.set_extent(extent)
+            self.fig_img.canvas.draw_idle()
+
+    def image_stats(self, data: np.ndarray = None) -> dict:
+        """ 
+        returns statistics and histogram of the displayed image, or of data (subsampled by viewer histo_step for previews)
+        """        
+        return stats_utils.get_stats(self.primary_data if data is None else data, bins = 64, 
+                                     step = int(self.config['viewer'].get('histo_step', 1)))
+
+    def __prefetch(self, path: str) -> None:
+        """ 
+        prefetcher loader (background thread) : decodes the file and computes its statistics
+        """        
+        data = files_utils.get_file(path)[2]
+        if isinstance(data, np.ndarray) and data.ndim >= 2:
+            self.image_stats(data)
+
     def display_histo(self) -> None:
         """ 
         show histogram 
@@ -348,11 +435,9 @@ class EasySpec(object):
             self.ax_histo.set_yscale('log');
             self.ax_histo.grid(False) ;
 
-            self.ax_histo.hist(self.primary_data.flatten(), 
-                bins=64,
-                range=[self.primary_data.min(), self.primary_data.max()], 
-                #align='mid'
-            )
+            ### computed once per image (see stats_utils) - no rescan on re-apply
+            stats = self.image_stats()
+            self.ax_histo.stairs(stats['histogram'], stats['edges'], fill = True)
             self.plt_histo = plt.show(self.fig_histo)
 
         except:
@@ -362,8 +447,8 @@ class EasySpec(object):
 
     def apply_all_changes(self, b: widgets) -> None:
         logger.info('applying all changes...')
+        ### display changes are applied with the transformed image
         self.apply_geometry_changes()
-        self.apply_display_changes(self.selected_file)
 
     def reset_all_changes(self, b: widgets):
         logger.info('resetting image...')
@@ -373,8 +458,9 @@ class EasySpec(object):
         transform_data = self.ax_img.transData
         self.img.set_transform(transform_data)
 
-        ### restore saved image
-        self.primary_data = self.saved_data.copy()
+        ### restore saved image (a transformation still running is not shown)
+        self.geometry_key = None
+        self.primary_data = self.saved_data
         self.apply_display_changes(self.selected_file)
         
     def load_config(self, b: widgets):
@@ -397,11 +483,12 @@ class EasySpec(object):
             if self.primary_data is not None:
                 logger.info('showing image : {}'.format(path))
                 logger.info('image size : {}'.format(self.primary_data.shape))
+                stats = self.image_stats()
                 logger.info('image stats : min = {}, max = {}, std = {}, mean = {}'.format(
-                        self.primary_data.min(), 
-                        self.primary_data.max(), 
-                        self.primary_data.std(), 
-                        self.primary_data.mean()
+                        stats['min'], 
+                        stats['max'], 
+                        stats['std'], 
+                        stats['mean']
                     )
                 )
     
@@ -410,43 +497,118 @@ class EasySpec(object):
                 self.ax_img.set_title(self.selected_file.split(os.sep)[-1])
                 #self.fig_img.suptitle(self.selected_file.split(os.sep)[-1])
                 self.img.set_cmap(self.cmap.value)
-                new_extent = [0,  self.primary_data.shape[1], 0,  self.primary_data.shape[0]]
-                self.img.set_extent (new_extent)
-                self.img.set_data(self.primary_data)
-                self.fig_img.canvas.draw_idle()
+                self.display_image()
                 self.display_histo()
 
 
     def apply_geometry_changes(self) -> None:
         """
         update image np array with geometry transformations defined by widgets contents
+        a preview is drawn at once from the display pyramid, the full resolution image is computed in background
         """
         logger.info('start applying transformation...')
 
         mtransforms.Affine2D().clear()
         transform_data = self.ax_img.transData
         self.img.set_transform(transform_data)
-        self.primary_data = self.saved_data.copy()
-        
-        if self.rotate.value != '':
-            new_array = self.primary_data.copy()
-            self.primary_data = ndimage.rotate(new_array, eval(self.rotate.value), reshape=False)
-            logger.info('rotation done')
-            new_array = None
-            
-        if self.skew.value != '':
-            transform_actions = mtransforms.Affine2D().skew_deg(eval(self.skew.value)[0], eval(self.skew.value)[1])
+
+        ### parameters read once
+        rotate = eval(self.rotate.value) if self.rotate.value != '' else None
+        crop = tuple(eval(self.crop.value)) if self.crop.value != '' else None
+        skew = tuple(eval(self.skew.value)) if self.skew.value != '' else None
+
+        if skew is not None:
+            transform_actions = mtransforms.Affine2D().skew_deg(skew[0], skew[1])
             transform_data = transform_actions + self.ax_img.transData
             self.img.set_transform(transform_data)
             logger.info('skew done')
 
-        if self.crop.value != '':
-            self.primary_data = self.primary_data[eval(self.crop.value)[1]:eval(self.crop.value)[3], eval(self.crop.value)[0]:eval(self.crop.value)[2]]
-            logger.info('crop done')
+        key = (id(self.saved_data), rotate, crop, skew)
+        self.geometry_key = key
+        cached = self.geometry_cache.get(key)
+        if cached is not None and cached[0] is self.saved_data:
+            self.geometry_cache.move_to_end(key)
+            logger.info('transformation already computed')
+            self.primary_data = cached[1]
+            self.apply_display_changes(self.selected_file)
+            return
+
+        ### preview on the saved image pyramid level matching the canvas - the pyramid is built once per saved image
+        if self.saved_pyramid is None or self.saved_pyramid.data is not self.saved_data:
+            if self.pyramid is not None and self.pyramid.data is self.saved_data:
+                self.saved_pyramid = self.pyramid
+            else:
+                self.saved_pyramid = DisplayPyramid(self.saved_data)
+        canvas = self.ax_img.get_window_extent()
+        level = self.saved_pyramid.level_for(self.saved_data.shape[1], self.saved_data.shape[0], canvas.width, canvas.height)
+        preview = EasySpec.geometry(self.saved_pyramid.levels[level], rotate, crop, 1 << level)
+        height, width = EasySpec.geometry(self.saved_data, None, crop).shape[:2]
+        ### no pan & zoom redraw over the preview until the full resolution image is shown
+        self.pyramid = None
+        self.img.norm.vmin = self.cut_levels.value[0]
+        self.img.norm.vmax = self.cut_levels.value[1]
+        self.img.set_cmap(self.cmap.value)
+        self.img.set_data(preview)
+        self.img.set_extent([0, width, 0, height])
+        self.ax_img.set_xlim(0, width)
+        self.ax_img.set_ylim(0, height)
+        self.fig_img.canvas.draw_idle()
+        logger.info('preview done - computing full resolution...')
+
+        saved_data = self.saved_data
+        future = self.geometry_executor.submit(EasySpec.geometry, saved_data, rotate, crop)
+        future.add_done_callback(lambda future: self.__call_soon(self.__geometry_done, key, saved_data, future))
+
+    def __call_soon(self, callback, *args) -> None:
+        """ 
+        run callback on the notebook event loop (widgets are not thread safe), or at once without event loop
+        """        
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(callback, *args)
+        else:
+            callback(*args)
 
-        self.apply_display_changes(self.selected_file)
+    def __geometry_done(self, key: tuple, saved_data: np.ndarray, future) -> None:
+        """ 
+        full resolution transformation done : cache it, show it if still the last one applied
+        """        
+        try:
+            result = future.result()
+        except Exception as error:
+            logger.error(f'transformation error : {error}')
+            return
+        result.setflags(write = False)
+        self.geometry_cache[key] = (saved_data, result)
+        while len(self.geometry_cache) > 4:
+            self.geometry_cache.popitem(last = False)
+        if key == self.geometry_key:
+            logger.info('full resolution transformation done')
+            self.primary_data = result
+            self.apply_display_changes(self.selected_file)
+
+    @staticmethod
+    def geometry(data: np.ndarray, rotate: float | None, crop: tuple | None, scale: int = 1) -> np.ndarray:
+        """ 
+        returns data rotated (degrees) then cropped (x1, y1, x2, y2 in full resolution pixels) - data is scale times smaller than full resolution
+        """        
+        if crop is not None:
+            x1, y1, x2, y2 = (int(value) // scale for value in crop)
+            rows, cols = slice(y1, y2).indices(data.shape[0])[:2], slice(x1, x2).indices(data.shape[1])[:2]
+        if rotate is None or data.ndim != 2:
+            if rotate is not None:
+                data = ndimage.rotate(data, rotate, reshape = False)
+            return data if crop is None else data[rows[0]:rows[1], cols[0]:cols[1]]
+
+        ### same transform as ndimage.rotate (reshape = False), only computed on the cropped pixels
+        angle = np.deg2rad(rotate)
+        rot_matrix = np.array([[np.cos(angle), np.sin(angle)], [-np.sin(angle), np.cos(angle)]])
+        center = (np.array(data.shape) - 1) / 2
+        if crop is None:
+            rows, cols = (0, data.shape[0]), (0, data.shape[1])
+        offset = center - rot_matrix @ center + rot_matrix @ np.array([rows[0], cols[0]])
+        return ndimage.affine_transform(data, rot_matrix, offset,
+                                        output_shape = (max(rows[1] - rows[0], 0), max(cols[1] - cols[0], 0)))
 
-       
     def display_plot(self, path: str) -> None:    
         """ 
         update plot with data contained in path
@@ -0,0 +1,182 @@
+""" EasyStacker stacks FIT frames one at a time, as they are captured
+
+every new frame is folded into per pixel accumulators (count, mean, Welford variance and an approximate median),
+so the current stack is available at any time without re-reading previous frames.
+new frames are optionally calibrated (bias, dark, flat) and sigma-clipped against the current stack.
+
+eg. : to follow a capture in progress :
+stacker = EasyStacker(master_bias, master_dark, master_flat, sigma_clip = 3)
+stacker.start(dir = "../CAPTURE/test01/", filter = "agdra-*.fit")
+...
+stacker.mean()          # current stack (CCDData)
+stacker.stop()
+
+"""
+from typing import List
+import os, fnmatch, threading, time
+import numpy as np
+from logger_utils import logger
+from astropy import units as u
+from astropy.nddata import CCDData, StdDevUncertainty
+from calib_utils import calib_utils
+
+class EasyStacker(object):
+    """
+    maintains per pixel running statistics of the frames added so far
+    sigma_clip (sigmas) rejects pixels deviating from the current mean, once min_frames frames are stacked
+    median_rate sets the step of the approximate median, relative to the current standard deviation
+    """
+    def __init__(self, master_bias: CCDData | None = None, master_dark: CCDData | None = None, master_flat: CCDData | None = None,
+                 exposure_key: str = 'EXPTIME', sigma_clip: float | None = None, min_frames: int = 3,
+                 median_rate: float = 0.1, dtype = np.float32):
+        self._masters = calib_utils.prepare_masters(master_bias, master_dark, master_flat, exposure_key)
+        self._calibrate = any(master is not None for master in (master_bias, master_dark, master_flat))
+        self._exposure_key = exposure_key
+        self._sigma_clip = sigma_clip
+        self._min_frames = min_frames
+        self._median_rate = median_rate
+        self._dtype = dtype
+        self._frames = 0
+        self._count = None
+        self._mean = None
+        self._m2 = None
+        self._median = None
+        self._header = None
+        self._stacked_files = set()
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self.watch_thread = None
+
+    """
+    returns the number of frames stacked so far
+    """
+    def __len__(self) -> int:
+        return self._frames
+
+    """
+    fold a new frame into the stack
+    """
+    def add(self, image: CCDData):
+        data = np.array(image.data, dtype = self._dtype)
+        if self._calibrate:
+            block = data[np.newaxis]
+            calib_utils.calibrate_block(block, calib_utils.read_exposures([image.header], self._exposure_key), self._masters)
+
+        with self._lock:
+            if self._mean is None:
+                self._count = np.zeros(data.shape, dtype = np.uint32)
+                self._mean = np.zeros(data.shape, dtype = self._dtype)
+                self._m2 = np.zeros(data.shape, dtype = self._dtype)
+                self._median = data.copy()
+                self._header = image.header.copy()
+            elif data.shape != self._mean.shape:
+                raise ValueError(f'frame shape {data.shape} does not match stack shape {self._mean.shape}')
+
+            ### pixels deviating from the current stack are not accumulated
+            accepted = np.ones(data.shape, dtype = bool)
+            if self._sigma_clip is not None and self._frames >= self._min_frames:
+                accepted = np.abs(data - self._mean) <= self._sigma_clip * self._std()
+
+            ### Welford update of mean and sum of squared deviations
+            self._count += accepted
+            delta = np.where(accepted, data - self._mean, 0)
+            self._mean += delta / np.maximum(self._count, 1)
+            self._m2 += delta * np.where(accepted, data - self._mean, 0)
+
+            ### stochastic approximation of the median : moves toward the new value by a fraction of sigma
+            if self._frames > 0:
+                step = self._median_rate * np.maximum(self._std(), np.finfo(self._dtype).eps)
+                self._median += np.where(accepted, step * np.sign(data - self._median), 0)
+
+            self._frames += 1
+
+        logger.info(f'stack : {self._frames} frames ({np.count_nonzero(~accepted)} pixels rejected)')
+        return self
+
+    """
+    read a FIT file and fold it into the stack
+    """
+    def add_file(self, file_path: str):
+        self.add(CCDData.read(file_path, unit = u.Unit('adu')))
+        self._stacked_files.add(os.path.abspath(file_path))
+        logger.info(f'stack : {file_path} added')
+        return self
+
+    """
+    stack FIT files of a directory matching filter that were not stacked yet (oldest first)
+    returns the number of files added
+    """
+    def update(self, dir: str, filter: str) -> int:
+        new_files = [fp for fp in (os.path.abspath(os.path.join(dir, name)) for name in fnmatch.filter(os.listdir(dir), filter))
+                     if fp not in self._stacked_files and os.path.isfile(fp)]
+        for fp in sorted(new_files, key = os.path.getmtime):
+            try:
+                self.add_file(fp)
+            except Exception as err:
+                ### file may still be written by the capture software : retried at next update
+                logger.warning(f'stack : {fp} not added ({err})')
+        return len(new_files)
+
+    """
+    watch a capture directory in background : new files are stacked every interval seconds
+    """
+    def start(self, dir: str, filter: str, interval: float = 1.):
+        def watch():
+            while not self._stop_event.is_set():
+                self.update(dir, filter)
+                self._stop_event.wait(interval)
+
+        self._stop_event.clear()
+        self.watch_thread = threading.Thread(target = watch, name = 'EASYSTACKER_watch_thread', daemon = True)
+        self.watch_thread.start()
+        logger.info(f'stack : watching {dir} for {filter}')
+        return self
+
+    """
+    stop watching the capture directory
+    """
+    def stop(self):
+        self._stop_event.set()
+        if self.watch_thread is not None:
+            self.watch_thread.join()
+        logger.info('stack : watch stopped')
+        return self
+
+    def _std(self) -> np.ndarray:
+        return np.sqrt(self._m2 / np.maximum(self._count - 1, 1))
+
+    def _result(self, data: np.ndarray, deviation: np.ndarray | None = None) -> CCDData:
+        if self._mean is None:
+            raise ValueError('no frame stacked yet')
+        header = self._header.copy()
+        header['NCOMBINE'] = self._frames
+        return CCDData(data, unit = u.adu, header = header,
+                       uncertainty = None if deviation is None else StdDevUncertainty(deviation))
+
+    """
+    returns the current mean stack - uncertainty is the standard error of the mean
+    """
+    def mean(self) -> CCDData:
+        with self._lock:
+            return self._result(self._mean.copy(), self._std() / np.sqrt(np.maximum(self._count, 1)))
+
+    """
+    returns the current sum stack (mean scaled to the number of frames, so rejected pixels are compensated)
+    """
+    def sum(self) -> CCDData:
+        with self._lock:
+            return self._result(self._mean * self._frames)
+
+    """
+    returns the current per pixel variance of stacked frames
+    """
+    def variance(self) -> CCDData:
+        with self._lock:
+            return self._result(self._m2 / np.maximum(self._count - 1, 1))
+
+    """
+    returns the current approximate median stack
+    """
+    def median(self) -> CCDData:
+        with self._lock:
+            return self._result(self._median.copy())
@@ -9,6 +9,10 @@
 """
 from files_utils import *
 from logger_utils import logger, handler
+from dir_watcher import DirWatcher
+from image_cache import image_cache
+from prefetcher import Prefetcher
+from viz_session import VizSession
 from ipyfilechooser import FileChooser
 from IPython.display import display
 import ipywidgets as widgets
@@ -26,6 +30,7 @@ from jdaviz import Imviz
 from astropy.io import fits
 from astropy import units as u
 from astropy.nddata import CCDData
+from astropy.wcs import WCS
 from specutils import Spectrum1D
 from jdaviz import Specviz
 
@@ -55,13 +60,19 @@ class EasyViewer(object):
             logger.error('FATAL : root directory not accessible : {} - please update config'.format(self.root_path))
             return 
             
+        ### files next to the selected one are decoded in background
+        self.prefetcher = Prefetcher(self.__prefetch, neighbours = int(self.config['viewer'].get('prefetch', 2)))
+
         self.__create_browser_gui()
         self.__create_viewer_gui()
 
-        ### monitors new files in background (TODO : check whether thread is already running)
-        self.watch_thread = threading.Thread(target = self.__watch_files, name='EASYSPEC_watch_thread')
-        self.watch_thread.start()
-        logger.debug('watch thread started - tid = {}'.format(self.watch_thread))          
+        ### monitors directory changes in background (file system events, or polling if watchdog is not installed)
+        self.watcher = DirWatcher(self.__files_changed)
+        self.watcher.watch(self.dir_select.selected_path)
+        self.dir_select.register_callback(lambda chooser: self.watcher.watch(chooser.selected_path))
+        self.files_filter.observe(lambda change: self.__refresh_files(), names = 'value')
+        self.auto_refresh.observe(lambda change: self.__refresh_files(), names = 'value')
+        logger.debug('watcher started - {}'.format(self.watcher.path))
 
     def __create_logger_gui(self) -> None:
         """ 
@@ -148,17 +159,20 @@ class EasyViewer(object):
         ### on_file_clic : display infos
         self.files_select.observe(self.display_infos, names = 'value')
 
-    def __watch_files(self) -> None:
+    def __files_changed(self, events: list) -> None:
+        """ 
+        directory watcher callback (runs on the notebook event loop) : events are lists of (added|removed|modified, file name)
+        """        
+        self.__refresh_files()
+
+    def __refresh_files(self) -> None:
         """ 
-        watch every sec newly created files - update list files widget contents
+        update list files widget contents from the watched directory listing (no directory scan)
         """        
         if self.auto_refresh.value:
-            while True:
-                #logger.debug('refreshing list of files...')
-                self.files_select.options = files_utils.list_files(self.dir_select.selected_path, self.files_filter.value)
-                self.files_select.value = None
-                time.sleep(1)
-                
+            self.files_select.options = self.watcher.files(self.files_filter.value)
+            self.files_select.value = None
+
     def __create_viewer_gui(self) -> None:
         """ 
         creates viewer panels
@@ -177,6 +191,11 @@ class EasyViewer(object):
             self.specviz = Specviz()
             self.specviz.show()
 
+        ### only the last max_datasets files stay loaded in each viewer
+        max_datasets = int(self.config['viewer'].get('max_datasets', 5))
+        self.imviz_session = VizSession(self.imviz, 'imviz-0', max_datasets)
+        self.specviz_session = VizSession(self.specviz, 'spectrum-viewer', max_datasets)
+
         display(widgets.VBox(children=[self.left_panel, self.right_panel]))
 
     def display_infos(self, change: str) -> None:
@@ -188,10 +207,34 @@ class EasyViewer(object):
             self.fit_header.value, self.naxis = files_utils.get_file_info(self.selected_file)
             logger.info('Selected file : {}'.format(self.selected_file))
             self.display_file(self.selected_file);
+            self.prefetcher.around(self.dir_select.selected_path, list(self.files_select.options), change['new'])
         else:
             logger.debug('No file selected');
 
 
+    def __prefetch(self, path: str) -> None:
+        """ 
+        prefetcher loader (background thread) : decodes file infos, FIT images and spectra
+        """        
+        naxis = files_utils.get_file_info(path)[1]
+        if naxis == 2 and pathlib.Path(path).suffix in fit_types:
+            files_utils.get_file(path)
+        elif naxis == 1:
+            image_cache.get(path, 'spectrum1d', lambda: Spectrum1D.read(path))
+
+    @staticmethod
+    def _fit_image(path: str) -> CCDData:
+        """ 
+        FIT image shown by imviz, decoded through the image cache (see files_utils.get_file) : scaled data and header WCS
+        """        
+        header, _, data = files_utils.get_file(path)
+        try:
+            wcs = WCS(fits.Header.fromstring(header, sep = '\n'))
+        except Exception as error:
+            logger.debug(f'no WCS in {path} ({error})')
+            wcs = None
+        return CCDData(data, unit = u.adu, wcs = wcs)
+
     def display_file(self, path: str) -> None: 
         """ 
         show image with data in file located in path
@@ -204,10 +247,15 @@ class EasyViewer(object):
                 if self.naxis == 2:
                     ### this is an image - use imviz 
                     logger.info('showing image: {}'.format(path))
-                    self.imviz.load_data(path, data_label = os.path.basename(path))
+                    if pathlib.Path(path).suffix in fit_types:
+                        ### decoded data (prefetched) are loaded, the file is not read again
+                        load = lambda: self.imviz.load_data(EasyViewer._fit_image(path), data_label = os.path.basename(path))
+                    else:
+                        load = lambda: self.imviz.load_data(path, data_label = os.path.basename(path))
+                    labels = self.imviz_session.show(path, load)
                     self.imviz.default_viewer.cuts = self.cuts
                     self.imviz.default_viewer.set_colormap(self.colormap)
-                    primary_data = self.imviz.get_data(data_label = os.path.basename(path) + '[PRIMARY,1]')
+                    primary_data = self.imviz.get_data(data_label = labels[0] if labels else os.path.basename(path) + '[PRIMARY,1]')
                     logger.info('image size: {}'.format(primary_data.shape))
                     logger.info('image stats: min = {}, max = {}, mean = {}'.format(
                             primary_data.min(), 
@@ -219,7 +267,7 @@ class EasyViewer(object):
                 elif self.naxis == 1:
                     ### this is a spectrum - use specviz
                     logger.info('showing spectrum: {}'.format(path))
-                    primary_data = Spectrum1D.read(path)  
+                    primary_data = image_cache.get(path, 'spectrum1d', lambda: Spectrum1D.read(path))
                     logger.info('spectrum stats: min = {}, max = {}, mean = {}'.format(
                             primary_data.min(), 
                             primary_data.max(), 
@@ -227,11 +275,20 @@ class EasyViewer(object):
                         )
                     )
 
-                    _spec1d = Spectrum1D(spectral_axis = primary_data.wavelength, flux = primary_data.flux * u.adu)
-                    self.specviz.load_data(_spec1d, data_label = os.path.basename(path))
+                    def load_spectrum():
+                        _spec1d = Spectrum1D(spectral_axis = primary_data.wavelength, flux = primary_data.flux * u.adu)
+                        self.specviz.load_data(_spec1d, data_label = os.path.basename(path))
+                    self.specviz_session.show(path, load_spectrum)
             
                 else:
                     ### more naxis options TO DO...
                     logger.warning('file type not displayable: {}'.format(path))
             #else:
                 #logger.warning('no data loaded');
+                logger.debug('viewer memory : {}'.format(self.memory_use()))
+
+    def memory_use(self) -> dict:
+        """ 
+        returns datasets loaded and their memory use (bytes) in imviz and specviz
+        """
+        return {'imviz': self.imviz_session.memory(), 'specviz': self.specviz_session.memory()}
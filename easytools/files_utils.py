@@ -3,6 +3,8 @@
 #
 import os, time, sys, configparser, threading, pathlib, re, fnmatch
 from logger_utils import logger
+from header_index import HeaderIndex
+from image_cache import image_cache
 import numpy as np
 from astropy.io import fits
 from astropy import units as u
@@ -14,6 +16,76 @@ dat_types = ['.csv', '.tsv', '.dat']
 txt_types = ['.lst', '.txt', '.log', '.yaml', '.yml', '.json', '.bas']
 img_types = ['.jpg', '.png', '.gif']
 
+class FitFile(object):
+    """
+    FIT file opened once, memory-mapped : header and naxis are read at open time,
+    pixel data are read (and the file closed) only when data is first accessed
+    as CCDData.read does, data are read from the first HDU holding data : an image extension if the primary HDU is empty
+    (its header then completed by the primary header keywords)
+    header_only reads the headers alone and never maps the data
+    """
+    def __init__(self, path: str, header_only: bool = False):
+        self.path = path
+        self._data = None
+        ### astropy refuses to scale memory-mapped data (BZERO/BSCALE) : scaling is applied when data are read
+        self._hdul = fits.open(path, memmap = True, do_not_scale_image_data = True)
+        self._index = FitFile._data_index(self._hdul)
+        self.header = self._hdul[self._index].header
+        if self._index != 0:
+            self.header = self.header.copy()
+            self.header.extend(self._hdul[0].header, unique = True)
+        self.naxis = self.header['NAXIS']
+        if header_only:
+            self.close()
+
+    @staticmethod
+    def _data_index(hdul: fits.HDUList) -> int:
+        """
+        index of the first HDU holding data : the primary one, else the first image extension with a non empty data block
+        """
+        if hdul[0].header.get('NAXIS', 0) > 0:
+            return 0
+        for index, hdu in enumerate(hdul[1:], start = 1):
+            if isinstance(hdu, (fits.ImageHDU, fits.CompImageHDU)) and hdul.fileinfo(index)['datSpan'] > 0:
+                return index
+        return 0
+
+    @property
+    def data(self) -> np.ndarray | None:
+        if self._data is None and self._hdul is not None:
+            self._data = FitFile._scale(self._hdul[self._index].data, self.header)
+            self.close()
+        return self._data
+
+    @staticmethod
+    def _scale(raw: np.ndarray | None, header: fits.Header) -> np.ndarray | None:
+        """
+        returns a copy of raw data out of the memory map, scaled as astropy does (physical = BZERO + BSCALE * raw)
+        """
+        if raw is None:
+            return None
+        bscale, bzero = header.get('BSCALE', 1), header.get('BZERO', 0)
+        if bscale == 1 and bzero == 0:
+            return np.array(raw)
+        if bscale == 1 and raw.dtype.kind == 'i' and bzero == 2 ** (8 * raw.dtype.itemsize - 1):
+            ### unsigned integers convention : flipping the sign bit adds BZERO
+            return (raw.astype(raw.dtype.newbyteorder('=')).view(f'u{raw.dtype.itemsize}') ^ np.uint64(bzero).astype(f'u{raw.dtype.itemsize}'))
+        data = raw * np.float32(bscale) + np.float32(bzero) if raw.dtype.itemsize <= 2 else raw * bscale + bzero
+        if 'BLANK' in header and raw.dtype.kind in 'iu':
+            data[raw == header['BLANK']] = np.nan
+        return data
+
+    def close(self) -> None:
+        if self._hdul is not None:
+            self._hdul.close()
+            self._hdul = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
 class files_utils:
 
     @staticmethod
@@ -39,16 +111,30 @@ class files_utils:
             for i in sorted(pathlib.Path(path).iterdir(), key = os.path.getmtime, reverse = True)), name)
 
     @staticmethod
-    def get_file_info(path: str) -> (str, int):
+    def get_file_info(path: str, use_index: bool = False) -> (str, int):
         """ 
         returns :
             - FIT header (if path is a FIT file) or file contents for .dat/.txt/.csv files
             - naxis for fits files (else naxis = 0)
+        with use_index, FIT headers are read from the directory headers index (see header_index)
+        results are cached until the file changes (see image_cache)
         """    
+        if use_index and pathlib.Path(path).suffix in fit_types:
+            try:
+                indexed = HeaderIndex(os.path.dirname(path) or '.').get(path)
+            except OSError:
+                indexed = None
+            if indexed is not None and indexed['NAXIS'] is not None:
+                return (indexed['header'], int(indexed['NAXIS']))
+            ### not indexed (unreadable, half written or missing file) : read directly, errors are reported the same way
+        return image_cache.get(path, 'info', lambda: files_utils._read_file_info(path))
+
+    @staticmethod
+    def _read_file_info(path: str) -> (str, int):
         if pathlib.Path(path).suffix in fit_types:       
             try:
-                fit_header = CCDData.read(path, unit = u.adu).header
-                return (repr(fit_header), fit_header['NAXIS'])
+                fit_file = FitFile(path, header_only = True)
+                return (repr(fit_file.header), fit_file.naxis)
             except KeyError:
                 return ('missing KEYS in FIT file', 0)        
             except IOError as e:
@@ -93,6 +179,29 @@ class files_utils:
         else:
             return ("File type not supported : " + pathlib.Path(path).suffix, 0)
             
+    @staticmethod
+    def get_file(path: str) -> (str, int, np):
+        """ 
+        returns file info, naxis and data (see get_file_info, get_file_data) - a FIT file is opened and decoded only once
+        decoded files are kept in the LRU image cache until they change : returned data is read-only, copy it before any in place change
+        """    
+        return image_cache.get(path, 'file', lambda: files_utils._read_file(path))
+
+    @staticmethod
+    def _read_file(path: str) -> (str, int, np):
+        if pathlib.Path(path).suffix in fit_types:
+            try:
+                with FitFile(path) as fit_file:
+                    ### loaded in memory : cached data must not depend on an open file
+                    return (repr(fit_file.header), fit_file.naxis, np.array(fit_file.data))
+            except KeyError:
+                return ('missing KEYS in FIT file', 0, np.zeros(shape=(10, 10)))
+
+        naxis, data = files_utils.get_file_data(path)
+        if pathlib.Path(path).suffix in img_types:
+            return (str(data.shape), naxis, data)
+        return (files_utils.get_file_info(path)[0], naxis, data)
+
     def get_file_data(path: str = None) -> (int, np):
         """ 
         opens the path file - returns a numpy array containing image data - manages all supported image types
@@ -103,8 +212,8 @@ class files_utils:
         ### FIT file 
         if pathlib.Path(path).suffix in fit_types:
             try:
-                fit_data = CCDData.read(path, unit = u.adu).data.copy()
-                naxis = CCDData.read(path, unit = u.adu).header['NAXIS'] 
+                fit_file = FitFile(path)
+                naxis, fit_data = fit_file.naxis, fit_file.data
             except:
                 raise 
 
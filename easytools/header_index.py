@@ -0,0 +1,123 @@
+#
+# persistent index of FIT headers of a capture directory (SQLite file stored in the directory)
+# an entry is refreshed only when its file size or last modified time changed
+#
+import os, fnmatch, sqlite3, threading
+from concurrent.futures import ThreadPoolExecutor
+from logger_utils import logger
+from astropy.io import fits
+
+fit_types = ['.fit', '.fits', '.fts']
+
+### indexed keywords : column name -> FIT keyword
+indexed_keywords = {
+    'date_obs': 'DATE-OBS',
+    'exptime': 'EXPTIME',
+    'imagetyp': 'IMAGETYP',
+    'naxis': 'NAXIS',
+    'filter': 'FILTER',
+}
+
+class HeaderIndex(object):
+    """
+    maintains the headers index of a directory
+    the index is stored in index_name inside the directory, or in memory if the directory is read-only
+    """
+    index_name = '.easyastro_headers.sqlite'
+
+    def __init__(self, directory: str, workers: int = 4):
+        self.directory = directory
+        self._workers = workers
+        self._lock = threading.Lock()
+        index_path = os.path.join(directory, HeaderIndex.index_name)
+        if not os.access(directory, os.W_OK):
+            logger.warning(f'index : {directory} is read-only - index kept in memory')
+            index_path = ':memory:'
+
+        self._db = sqlite3.connect(index_path, check_same_thread = False)
+        columns = ', '.join(f'{column} TEXT' if column not in ('exptime', 'naxis') else f'{column} REAL'
+                            for column in indexed_keywords)
+        with self._lock, self._db:
+            self._db.execute(f'CREATE TABLE IF NOT EXISTS headers (name TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, {columns}, header TEXT)')
+
+    """
+    update index entries of files matching filter - returns the number of headers read
+    """
+    def refresh(self, files_filter: str = '*') -> int:
+        with os.scandir(self.directory) as entries:
+            stats = {entry.name: entry.stat() for entry in entries
+                     if entry.is_file() and os.path.splitext(entry.name)[1].lower() in fit_types}
+
+        with self._lock:
+            indexed = [name for (name, ) in self._db.execute('SELECT name FROM headers')]
+        removed = [name for name in indexed if name not in stats]
+        with self._lock, self._db:
+            self._db.executemany('DELETE FROM headers WHERE name = ?', [(name, ) for name in removed])
+
+        return self._update({name: stats[name] for name in fnmatch.filter(stats, files_filter)}, len(removed))
+
+    def _update(self, stats: dict, removed: int = 0) -> int:
+        """
+        reads headers of files (name -> os.stat_result) whose size or modified time changed since indexed
+        """
+        with self._lock:
+            indexed = {name: (size, mtime_ns) for name, size, mtime_ns in self._db.execute('SELECT name, size, mtime_ns FROM headers')}
+        outdated = [name for name in stats if indexed.get(name) != (stats[name].st_size, stats[name].st_mtime_ns)]
+
+        with ThreadPoolExecutor(max_workers = self._workers) as executor:
+            headers = list(executor.map(self._read_header, outdated))
+
+        rows = [(name, stats[name].st_size, stats[name].st_mtime_ns, *values)
+                for name, values in zip(outdated, headers) if values is not None]
+        placeholders = ', '.join('?' * (len(indexed_keywords) + 4))
+        with self._lock, self._db:
+            self._db.executemany(f'INSERT OR REPLACE INTO headers VALUES ({placeholders})', rows)
+
+        if len(outdated) > 0 or removed > 0:
+            logger.info(f'index : {len(rows)} headers indexed, {removed} removed in {self.directory}')
+        return len(rows)
+
+    def _read_header(self, name: str) -> tuple | None:
+        try:
+            header = fits.getheader(os.path.join(self.directory, name))
+        except Exception as err:
+            logger.warning(f'index : cannot read header of {name} ({err})')
+            return None
+        values = tuple(header.get(keyword) for keyword in indexed_keywords.values())
+        return tuple(value if value is None or isinstance(value, (int, float)) else str(value) for value in values) + (header.tostring(sep = '\n', endcard = False, padding = False), )
+
+    """
+    returns the paths of files matching filter, sorted by sort_key (a FIT keyword of indexed_keywords)
+    keyword values to match can be given, eg. query('*.fit', imagetyp = 'Dark Frame')
+    files without sort key go last, ties are ordered by file name
+    """
+    def query(self, files_filter: str = '*', sort_key: str = 'date-obs', **keywords) -> list[str]:
+        self.refresh(files_filter)
+        sort_column = HeaderIndex._column(sort_key)
+        where = ''.join(f' AND {HeaderIndex._column(keyword)} = ?' for keyword in keywords)
+        with self._lock:
+            names = [name for (name, ) in self._db.execute(
+                f'SELECT name FROM headers WHERE 1 = 1{where} ORDER BY {sort_column} IS NULL, {sort_column}, name',
+                tuple(keywords.values()))]
+        return [os.path.join(self.directory, name) for name in fnmatch.filter(names, files_filter)]
+
+    """
+    returns indexed values of a file as a dict (FIT keywords + 'header' as text), None if file is not a FIT file
+    """
+    def get(self, file_path: str) -> dict | None:
+        name = os.path.basename(file_path)
+        if os.path.splitext(name)[1].lower() not in fit_types:
+            return None
+        self._update({name: os.stat(os.path.join(self.directory, name))})
+        with self._lock:
+            row = self._db.execute(f'SELECT {", ".join(indexed_keywords)}, header FROM headers WHERE name = ?', (name, )).fetchone()
+        if row is None:
+            return None
+        return dict(zip(list(indexed_keywords.values()) + ['header'], row))
+
+    @staticmethod
+    def _column(keyword: str) -> str:
+        column = keyword.lower().replace('-', '_')
+        if column not in indexed_keywords:
+            raise ValueError(f'keyword {keyword} is not indexed - indexed keywords : {list(indexed_keywords.values())}')
+        return column
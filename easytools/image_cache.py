@@ -0,0 +1,142 @@
+#
+# process-wide LRU cache of decoded files (arrays, headers, Spectrum1D...) shared by the files browsers
+# an entry is valid as long as its file size and last modified time do not change
+#
+import os, sys, threading
+from collections import OrderedDict
+from typing import Callable, Any
+import numpy as np
+from logger_utils import logger
+
+class ImageCache(object):
+    """
+    keeps the most recently used decoded files within max_bytes
+    cached arrays are read-only : callers copy them before any in place change
+    """
+    def __init__(self, max_bytes: int = 1 << 30):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._loading = {}
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    """
+    returns the kind ('data', 'header', 'spectrum'...) of file path decoded by loader, from cache if file did not change
+    """
+    def get(self, path: str, kind: str, loader: Callable[[], Any]) -> Any:
+        key = (os.path.abspath(path), kind)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            ### missing file : nothing to cache, the loader reports the error
+            return loader()
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == stamp:
+                self._entries.move_to_end(key)
+                self._stats['hits'] += 1
+                return entry[1]
+            loading = self._loading.get(key)
+            if loading is None:
+                if entry is not None:
+                    self._remove(key)
+                    self._stats['invalidations'] += 1
+                self._stats['misses'] += 1
+                self._loading[key] = threading.Event()
+
+        if loading is not None:
+            ### already being decoded (eg. prefetched) : wait for it instead of decoding twice
+            loading.wait()
+            return self.get(path, kind, loader)
+
+        ### decoded outside the lock : other files stay available meanwhile
+        try:
+            value = loader()
+            size = ImageCache._sizeof(value)
+            ImageCache._freeze(value)
+            with self._lock:
+                if key in self._entries:
+                    self._remove(key)
+                if size <= self.max_bytes:
+                    self._entries[key] = (stamp, value, size)
+                    self._bytes += size
+                    self._evict()
+        finally:
+            with self._lock:
+                self._loading.pop(key).set()
+        return value
+
+    """
+    returns True if the kind of file path is cached and up to date
+    """
+    def contains(self, path: str, kind: str) -> bool:
+        key = (os.path.abspath(path), kind)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and entry[0] == (stat.st_mtime_ns, stat.st_size)
+
+    """
+    returns cache statistics : hits, misses, evictions, invalidations, entries and bytes used
+    """
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, 'entries': len(self._entries), 'bytes': self._bytes, 'max_bytes': self.max_bytes}
+
+    """
+    drop all entries (statistics are kept)
+    """
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _remove(self, key: tuple) -> None:
+        self._bytes -= self._entries.pop(key)[2]
+
+    def _evict(self) -> None:
+        while self._bytes > self.max_bytes and len(self._entries) > 0:
+            key, (_, _, size) = self._entries.popitem(last = False)
+            self._bytes -= size
+            self._stats['evictions'] += 1
+            logger.debug(f'cache : {key[0]} ({key[1]}) evicted - {size / 1e6:.1f} MB')
+
+    @staticmethod
+    def _arrays(value: Any) -> list:
+        """
+        arrays held by a cached value : ndarray, tuple/list of values, or object with data/flux/uncertainty/mask arrays
+        """
+        if isinstance(value, np.ndarray):
+            return [value]
+        if isinstance(value, (tuple, list)):
+            return [array for item in value for array in ImageCache._arrays(item)]
+        arrays = []
+        for name in ('data', 'flux', 'spectral_axis', 'mask'):
+            attribute = getattr(value, name, None)
+            if isinstance(attribute, np.ndarray):
+                arrays.append(attribute)
+        uncertainty = getattr(value, 'uncertainty', None)
+        if uncertainty is not None and isinstance(getattr(uncertainty, 'array', None), np.ndarray):
+            arrays.append(uncertainty.array)
+        return arrays
+
+    @staticmethod
+    def _sizeof(value: Any) -> int:
+        arrays = ImageCache._arrays(value)
+        others = value if isinstance(value, (tuple, list)) else [value]
+        ### headers and text contents are counted too (arrays apart)
+        return sum(array.nbytes for array in arrays) + \
+               sum(sys.getsizeof(item) for item in others if not isinstance(item, np.ndarray))
+
+    @staticmethod
+    def _freeze(value: Any) -> None:
+        for array in ImageCache._arrays(value):
+            array.setflags(write = False)
+
+### shared by all browsers of the process
+image_cache = ImageCache()
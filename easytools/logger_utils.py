@@ -2,9 +2,11 @@
 # output logging messages to a dedicated jupyter cell 
 # from : https://ipywidgets.readthedocs.io/en/latest/examples/Output%20Widget.html#integrating-output-widgets-with-the-logging-module
 # and from https://stackoverflow.com/questions/384076/how-can-i-color-python-logging-output
+# records are kept in a ring buffer (max_lines) and sent to the widget in batches (at most max_rate updates per second)
 #
 import ipywidgets as widgets
-import logging
+import logging, threading, time
+from collections import deque
 
 class CustomFormatter(logging.Formatter):
     green = "\x1b[32;20m"
@@ -33,16 +35,43 @@ class CustomFormatter(logging.Formatter):
 class OutputWidgetHandler(logging.Handler):
     """ Custom logging handler sending logs to an output widget """
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, max_lines: int = 1000, max_rate: float = 4.0, **kwargs):
         super(OutputWidgetHandler, self).__init__(*args, **kwargs)
         layout = {'width': '99.6%', 'height': '160px', 'border': '1px solid grey', 'overflow': 'auto'}
         self.out = widgets.Output(layout=layout)
+        self.lines = deque(maxlen = max_lines)
+        self.max_rate = max_rate
+        self._last_flush = 0.0
+        self._timer = None
 
     def emit(self, record):
-        """ Overload of logging.Handler method """
-        formatted_record = self.format(record)
-        new_output = {'name': 'stdout', 'output_type': 'stream', 'text': formatted_record+'\n'}
-        self.out.outputs = (new_output, ) + self.out.outputs
+        """ Overload of logging.Handler method : record is buffered, the widget updated at a capped rate """
+        self.lines.append(self.format(record))
+        if self._timer is None:
+            delay = self._last_flush + 1 / self.max_rate - time.monotonic()
+            if delay <= 0:
+                self.flush()
+            else:
+                ### records coming meanwhile are sent together
+                self._timer = threading.Timer(delay, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        """ Send buffered logs to the widget (newest first) - one widget update whatever the number of records """
+        with self.lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            self._last_flush = time.monotonic()
+            if len(self.lines) > 0:
+                text = '\n'.join(reversed(self.lines)) + '\n'
+                self.out.outputs = ({'name': 'stdout', 'output_type': 'stream', 'text': text}, )
+
+    def set_max_lines(self, max_lines: int):
+        """ Change the number of lines kept (oldest lines dropped first) """
+        with self.lock:
+            self.lines = deque(self.lines, maxlen = max_lines)
         
     def show_logs(self):
         """ Show the logs """
@@ -50,6 +79,8 @@ class OutputWidgetHandler(logging.Handler):
     
     def clear_logs(self):
         """ Clear the current logs """
+        with self.lock:
+            self.lines.clear()
         self.out.clear_output()
 
 logger = logging.getLogger(__name__)
@@ -0,0 +1,52 @@
+#
+# background decoding of the files next to the current selection of a files browser (into the image cache)
+# prefetches still queued when the selection jumps elsewhere are cancelled
+#
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+from logger_utils import logger
+
+class Prefetcher(object):
+    """
+    load(path) decodes a file through the image cache (see image_cache) - it returns at once for a cached file
+    """
+    def __init__(self, load: Callable[[str], None], neighbours: int = 2, workers: int = 2):
+        self._load = load
+        self.neighbours = neighbours
+        self._executor = ThreadPoolExecutor(max_workers = workers, thread_name_prefix = 'EASYASTRO_prefetch')
+        self._futures = {}
+
+    """
+    prefetch the neighbours of name in names (the browser list order) : next ones first, then previous ones
+    """
+    def around(self, directory: str, names: list, name: str) -> None:
+        if self.neighbours <= 0 or name not in names:
+            return
+        index = names.index(name)
+        wanted = []
+        for distance in range(1, self.neighbours + 1):
+            for neighbour in (index + distance, index - distance):
+                if 0 <= neighbour < len(names):
+                    wanted.append(os.path.join(directory, names[neighbour]))
+        self.prefetch(wanted)
+
+    """
+    decode paths in background (in order) - cancels queued prefetches of other paths
+    """
+    def prefetch(self, paths: list) -> None:
+        for path, future in list(self._futures.items()):
+            if path not in paths and future.cancel():
+                logger.debug(f'prefetch : {path} cancelled')
+            if future.done():
+                del self._futures[path]
+        for path in paths:
+            if path not in self._futures and os.path.isfile(path):
+                self._futures[path] = self._executor.submit(self._run, path)
+
+    def _run(self, path: str) -> None:
+        try:
+            self._load(path)
+        except Exception as error:
+            ### reported when the file is really displayed
+            logger.debug(f'prefetch : {path} failed ({error})')
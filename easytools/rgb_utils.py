@@ -0,0 +1,105 @@
+#
+# decoding of colour image files (PNG, JPEG, TIFF) into float32 channel planes
+# channels are extracted and bayer matrices debayered by array slicing (no per pixel loop)
+#
+import os
+import numpy as np
+import tifffile
+from PIL import Image
+from astropy.io import fits
+
+rgb_channels = {'R': 0, 'G': 1, 'B': 2}
+tiff_types = ('.tif', '.tiff', '.TIF', '.TIFF')
+bayer_patterns = ['RGGB', 'BGGR', 'GRBG', 'GBRG']
+
+### EXIF tags read into the FIT header (Exif sub IFD)
+exif_ifd = 0x8769
+exif_exposure_time = 33434
+exif_date_time_original = 36867
+
+class rgb_utils:
+
+    @staticmethod
+    def read_image(file_path: str) -> tuple[np.ndarray, fits.Header]:
+        """
+        decodes an image file - returns its pixels (rows, cols) or (rows, cols, 3) at their native depth (8 or 16 bits)
+        and a FIT header built from the file EXIF (EXPTIME, DATE-OBS) when present
+        Pillow reads 16 bits colour files as 8 bits : such TIFF files are decoded by tifffile, other formats raise ValueError
+        """
+        with Image.open(file_path) as image:
+            ### checked before reading EXIF (that may load the image)
+            truncated = rgb_utils._truncated(image)
+            exif = image.getexif().get_ifd(exif_ifd)
+            if truncated:
+                if os.path.splitext(file_path)[1] not in tiff_types:
+                    raise ValueError(f'{file_path} : 16 bits colour image cannot be decoded without losing 8 bits - convert it to TIFF')
+                with tifffile.TiffFile(file_path) as tiff:
+                    page = tiff.pages[0]
+                    data = page.asarray()
+                    if page.axes.startswith('S'):
+                        ### planar configuration : channels first
+                        data = np.moveaxis(data, 0, -1)
+            else:
+                if image.mode in ('RGBA', 'P', 'CMYK', 'YCbCr', 'LA'):
+                    image = image.convert('RGB')
+                data = np.asarray(image)
+        if data.ndim == 3:
+            ### alpha channel is dropped, never converted
+            data = data[..., :3]
+
+        header = fits.Header()
+        header['FILENAME'] = os.path.basename(file_path)
+        if exif_exposure_time in exif:
+            header['EXPTIME'] = (float(exif[exif_exposure_time]), 'exposure time (s) from EXIF')
+        if exif_date_time_original in exif:
+            date, time = str(exif[exif_date_time_original]).split(' ')
+            header['DATE-OBS'] = (date.replace(':', '-') + 'T' + time, 'from EXIF')
+        return data, header
+
+    @staticmethod
+    def _truncated(image: Image.Image) -> bool:
+        """
+        True if Pillow decodes image with less bits than stored (16 bits samples of a colour image)
+        """
+        if image.mode.startswith(('I', 'F')):
+            return False
+        ### TIFF : bits per sample tag
+        if np.max(getattr(image, 'tag_v2', {}).get(258, 8)) > 8:
+            return True
+        for tile in image.tile:
+            rawmode = tile[3][0] if isinstance(tile[3], tuple) else tile[3]
+            if isinstance(rawmode, str) and ';16' in rawmode:
+                return True
+        return False
+
+    @staticmethod
+    def split_channel(data: np.ndarray, channel: str = 'L', bayer: str | None = None) -> np.ndarray:
+        """
+        returns one float32 channel plane of a decoded image :
+            - channel 'R', 'G', 'B' or 'L' (sum of the 3 channels, so counts are preserved)
+            - bayer pattern (eg. 'RGGB') of a raw mono frame : superpixel debayering, planes are half size
+              and the 2 green photosites are averaged
+        a mono frame without bayer pattern is returned as is whatever the channel
+        """
+        if channel not in ('L', *rgb_channels):
+            raise ValueError(f'unknown channel : {channel} - supported : L, R, G, B')
+        if bayer is not None:
+            if bayer not in bayer_patterns:
+                raise ValueError(f'unknown bayer pattern : {bayer} - supported : {bayer_patterns}')
+            if data.ndim != 2:
+                raise ValueError(f'bayer pattern {bayer} needs a mono raw frame, got shape {data.shape}')
+            n_rows, n_cols = data.shape[0] // 2 * 2, data.shape[1] // 2 * 2
+            ### photosites of the 2x2 cell : pattern letters are (0, 0), (0, 1), (1, 0), (1, 1)
+            sites = [data[dy:n_rows:2, dx:n_cols:2] for dy, dx in ((0, 0), (0, 1), (1, 0), (1, 1))]
+            planes = {colour: [site for letter, site in zip(bayer, sites) if letter == colour] for colour in rgb_channels}
+            if channel == 'L':
+                return np.sum(sites, axis = 0, dtype = np.float32)
+            if channel == 'G':
+                return np.add(*planes['G'], dtype = np.float32) / np.float32(2)
+            return planes[channel][0].astype(np.float32)
+
+        if data.ndim == 2:
+            return data.astype(np.float32)
+        if channel == 'L':
+            return data.sum(axis = 2, dtype = np.float32)
+        return data[..., rgb_channels[channel]].astype(np.float32)
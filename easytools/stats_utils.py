@@ -0,0 +1,106 @@
+#
+# single pass statistics (min, max, mean, std) and histogram of an image, for display purposes
+# 8/16 bits integer images are counted with one bincount (exact, no copy), other types are scanned by strips
+# results are cached per image : images are never modified in place (see image_cache)
+#
+import weakref
+import numpy as np
+
+### float images are scanned by strips of this many pixels (kept in the CPU caches)
+strip_pixels = 1 << 20
+
+class stats_utils:
+
+    _cache = {}
+
+    @staticmethod
+    def get_stats(data: np.ndarray, bins: int = 64, step: int = 1) -> dict:
+        """
+        returns min, max, mean, std, pixel count and histogram (counts, edges over [min, max]) of an image
+        non finite pixels are ignored - step > 1 subsamples rows and columns (preview)
+        the result is computed once per image and step
+        """
+        key = (id(data), bins, step)
+        cached = stats_utils._cache.get(key)
+        if cached is not None and cached[0]() is data:
+            return cached[1]
+
+        sample = data[::step, ::step] if step > 1 and data.ndim >= 2 else data
+        if sample.dtype.kind in 'ui' and sample.dtype.itemsize <= 2:
+            stats = stats_utils._integer_stats(sample, bins)
+        else:
+            stats = stats_utils._float_stats(sample, bins)
+
+        try:
+            reference = weakref.ref(data, lambda _, key = key: stats_utils._cache.pop(key, None))
+            stats_utils._cache[key] = (reference, stats)
+        except TypeError:
+            pass
+        return stats
+
+    @staticmethod
+    def _integer_stats(data: np.ndarray, bins: int) -> dict:
+        """
+        one bincount over the raw values : all statistics derive from the counts of every possible value
+        """
+        ### FIT data are big-endian : bytes are reinterpreted in native order only
+        data = data.astype(data.dtype.newbyteorder('='), copy = False)
+        unsigned = np.dtype(f'u{data.dtype.itemsize}')
+        counts = np.bincount(np.ascontiguousarray(data).view(unsigned).ravel(), minlength = 1 << (8 * data.dtype.itemsize))
+        values = np.arange(len(counts), dtype = np.float64)
+        if data.dtype.kind == 'i':
+            ### two's complement : negative values come last, put them first
+            half = len(counts) // 2
+            counts = np.concatenate((counts[half:], counts[:half]))
+            values -= half
+        present = np.flatnonzero(counts)
+        if len(present) == 0:
+            return stats_utils._empty(bins)
+        counts, values = counts[present[0]:present[-1] + 1], values[present[0]:present[-1] + 1]
+
+        n = int(counts.sum())
+        mean = float(np.dot(counts, values) / n)
+        variance = float(np.dot(counts, np.square(values - mean)) / n)
+        edges = np.linspace(values[0], values[-1], bins + 1)
+        bin_index = np.minimum(((values - values[0]) * bins / max(values[-1] - values[0], 1)).astype(np.intp), bins - 1)
+        histogram = np.bincount(bin_index, weights = counts, minlength = bins)
+        return {'min': float(values[0]), 'max': float(values[-1]), 'mean': mean, 'std': float(np.sqrt(variance)),
+                'count': n, 'histogram': histogram, 'edges': edges}
+
+    @staticmethod
+    def _float_stats(data: np.ndarray, bins: int) -> dict:
+        """
+        strip scans : min, max, sums in the first pass, histogram in the second (its range is only known then)
+        """
+        flat = data.reshape(-1) if data.flags.c_contiguous else data.ravel()
+        n, total, total_squared, low, high, finite = 0, 0.0, 0.0, np.inf, -np.inf, True
+        for start in range(0, flat.size, strip_pixels):
+            strip = flat[start:start + strip_pixels].astype(np.float64)
+            strip_sum = strip.sum()
+            if not np.isfinite(strip_sum):
+                strip, finite = strip[np.isfinite(strip)], False
+                strip_sum = strip.sum()
+            if strip.size == 0:
+                continue
+            n += strip.size
+            total += strip_sum
+            total_squared += np.dot(strip, strip)
+            low, high = min(low, strip.min()), max(high, strip.max())
+        if n == 0:
+            return stats_utils._empty(bins)
+
+        mean = total / n
+        histogram = np.zeros(bins, dtype = np.float64)
+        for start in range(0, flat.size, strip_pixels):
+            strip = flat[start:start + strip_pixels]
+            if not finite:
+                strip = strip[np.isfinite(strip)]
+            histogram += np.histogram(strip, bins = bins, range = (low, high))[0]
+        return {'min': float(low), 'max': float(high), 'mean': float(mean),
+                'std': float(np.sqrt(max(total_squared / n - mean ** 2, 0))),
+                'count': n, 'histogram': histogram, 'edges': np.linspace(low, high, bins + 1)}
+
+    @staticmethod
+    def _empty(bins: int) -> dict:
+        return {'min': np.nan, 'max': np.nan, 'mean': np.nan, 'std': np.nan,
+                'count': 0, 'histogram': np.zeros(bins), 'edges': np.linspace(0, 1, bins + 1)}
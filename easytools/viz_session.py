@@ -0,0 +1,82 @@
+#
+# bounded data collection of a jdaviz application (Imviz, Specviz) browsed file after file
+# keeps the last max_datasets files loaded, unloads older ones, reuses the data of a file selected again
+#
+import os
+from collections import OrderedDict
+from typing import Callable
+import numpy as np
+from logger_utils import logger
+
+class VizSession(object):
+    """
+    viz is a jdaviz helper (Imviz, Specviz...), viewer_reference the viewer files are shown in ('imviz-0', 'spectrum-viewer')
+    """
+    def __init__(self, viz, viewer_reference: str, max_datasets: int = 5):
+        self.viz = viz
+        self.viewer_reference = viewer_reference
+        self.max_datasets = max_datasets
+        self._entries = OrderedDict()
+
+    """
+    show path : load() loads it into the application - called only if path is not loaded yet or changed since
+    returns the data labels of path
+    """
+    def show(self, path: str, load: Callable[[], None]) -> list:
+        stat = os.stat(path)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        labels = self._labels()
+        entry = self._entries.get(path)
+        if entry is not None and entry[0] == stamp and all(label in labels for label in entry[1]):
+            self._entries.move_to_end(path)
+            for label in entry[1]:
+                self.viz.app.add_data_to_viewer(self.viewer_reference, label)
+            logger.debug(f'viewer : {os.path.basename(path)} already loaded')
+            return entry[1]
+
+        if entry is not None:
+            self._unload(path)
+        load()
+        new_labels = [label for label in self._labels() if label not in labels]
+        self._entries[path] = (stamp, new_labels)
+
+        while len(self._entries) > self.max_datasets:
+            self._unload(next(iter(self._entries)))
+        return new_labels
+
+    """
+    returns the number of datasets loaded and their memory use (bytes)
+    """
+    def memory(self) -> dict:
+        return {'datasets': len(self.viz.app.data_collection),
+                'bytes': sum(VizSession._data_bytes(data) for data in self.viz.app.data_collection)}
+
+    """
+    unload all files
+    """
+    def clear(self) -> None:
+        for path in list(self._entries):
+            self._unload(path)
+
+    def _labels(self) -> list:
+        return [data.label for data in self.viz.app.data_collection]
+
+    def _unload(self, path: str) -> None:
+        data_collection = self.viz.app.data_collection
+        for label in self._entries.pop(path)[1]:
+            if label in self._labels():
+                data_collection.remove(data_collection[label])
+        logger.debug(f'viewer : {os.path.basename(path)} unloaded')
+
+    @staticmethod
+    def _data_bytes(data) -> int:
+        """
+        memory of the main components of a glue Data (coordinates components are computed on demand, not counted)
+        """
+        size = 0
+        for component_id in data.main_components:
+            try:
+                size += np.asarray(data.get_component(component_id).data).nbytes
+            except Exception:
+                pass
+        return size